@@ -0,0 +1,46 @@
+"""Compare formatting a waveform as a stringArray one element at a time with
+formatting it in a single operation, as ChannelFormatter.for_ndarray does.
+
+Run with: python benchmark/string_array.py
+"""
+
+import timeit
+
+import numpy as np
+
+from coniql.types import ChannelFormatter, make_number_format_string
+
+PRECISION = 5
+SIZES = [1_000, 100_000, 1_000_000]
+REPEATS = 5
+
+
+def per_element(value: np.ndarray):
+    func = make_number_format_string(PRECISION).format
+    return [func(x) for x in value]
+
+
+def main():
+    to_string_array = ChannelFormatter.for_ndarray(PRECISION, "").to_string_array
+    rng = np.random.default_rng(0)
+    print(f"{'elements':>10} {'per element':>12} {'for_ndarray':>12} {'speedup':>8}")
+    for size in SIZES:
+        value = rng.normal(size=size) * 1000
+        assert to_string_array(value, 0, 0) == per_element(value)
+        number = max(1, 100_000 // size)
+        old = min(
+            timeit.repeat(lambda: per_element(value), number=number, repeat=REPEATS)
+        )
+        new = min(
+            timeit.repeat(
+                lambda: to_string_array(value, 0, 0), number=number, repeat=REPEATS
+            )
+        )
+        print(
+            f"{size:>10} {old / number * 1e3:>10.2f}ms {new / number * 1e3:>10.2f}ms"
+            f" {old / new:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
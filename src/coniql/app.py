@@ -1,7 +1,7 @@
 import logging
 from argparse import ArgumentParser
 from datetime import timedelta
-from typing import Any, Optional
+from typing import Any, Optional, cast
 
 import aiohttp_cors
 from aiohttp import web
@@ -11,14 +11,20 @@ from strawberry.schema.config import StrawberryConfig
 from strawberry.subscriptions import GRAPHQL_TRANSPORT_WS_PROTOCOL, GRAPHQL_WS_PROTOCOL
 
 import coniql.strawberry_schema as schema
+from coniql.broadcast import SharedGraphQLTransportWSHandler, SharedGraphQLWSHandler
+from coniql.caplugin import (
+    CA_METADATA_TTL,
+    CA_MONITOR_LINGER,
+    CAPlugin,
+)
+from coniql.clock import sim_clock
 from coniql.metrics import (
     MetricsExtension,
-    MetricsGraphQLTransportWSHandler,
-    MetricsGraphQLWSHandler,
     MetricsSchema,
     handle_metrics,
     metrics_middleware,
 )
+from coniql.offload import OFFLOAD_THRESHOLD_BYTES
 
 from . import __version__
 
@@ -40,10 +46,11 @@ def create_schema(debug: bool):
 
 
 class GraphQLViewExtension(GraphQLView):
-    """Use custom handlers to enable inprogress metrics for subscriptions"""
+    """Use custom handlers to enable inprogress metrics for subscriptions, and to
+    share the results of identical subscriptions between clients"""
 
-    graphql_transport_ws_handler_class = MetricsGraphQLTransportWSHandler
-    graphql_ws_handler_class = MetricsGraphQLWSHandler
+    graphql_transport_ws_handler_class = SharedGraphQLTransportWSHandler
+    graphql_ws_handler_class = SharedGraphQLWSHandler
 
 
 def create_app(
@@ -139,8 +146,40 @@ def main(args=None) -> None:
         default=False,
         help="Enable GraphiQL for testing at localhost:8080/ws",
     )
+    parser.add_argument(
+        "--ca-linger",
+        type=float,
+        default=CA_MONITOR_LINGER,
+        help="Seconds to keep CA monitors open after their last subscriber has gone",
+    )
+    parser.add_argument(
+        "--ca-metadata-ttl",
+        type=float,
+        default=CA_METADATA_TTL,
+        help="Seconds to reuse the control metadata of a PV between gets",
+    )
+    parser.add_argument(
+        "--offload-bytes",
+        type=int,
+        default=OFFLOAD_THRESHOLD_BYTES,
+        help="Format arrays of at least this many bytes in worker threads, "
+        "0 to always format them in the event loop",
+    )
+    parser.add_argument(
+        "--sim-virtual-clock",
+        action="store_true",
+        default=False,
+        help="Run sims in virtual time, as fast as updates can be processed",
+    )
     parsed_args = parser.parse_args(args)
 
+    ca_plugin = cast(CAPlugin, schema.store_global.plugins["ca"])
+    ca_plugin.subscription_manager.linger = parsed_args.ca_linger
+    ca_plugin.subscription_manager.metadata.ttl = parsed_args.ca_metadata_ttl
+    schema.array_offloader.threshold = parsed_args.offload_bytes
+    if parsed_args.sim_virtual_clock:
+        sim_clock.set_virtual()
+
     logger_fmt = "[%(asctime)s::%(name)s::%(levelname)s]: %(message)s"
     configure_logger(parsed_args.debug, logger_fmt)
 
@@ -0,0 +1,429 @@
+import asyncio
+import json
+from collections import deque
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Deque,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    cast,
+)
+from weakref import WeakKeyDictionary
+
+from graphql import (
+    ExecutionResult,
+    FieldNode,
+    GraphQLError,
+    OperationDefinitionNode,
+    parse,
+    value_from_ast_untyped,
+)
+from strawberry.schema import BaseSchema
+from strawberry.subscriptions.protocols.graphql_transport_ws.handlers import Operation
+from strawberry.subscriptions.protocols.graphql_transport_ws.types import (
+    ErrorMessage,
+    SubscribeMessage,
+    SubscribeMessagePayload,
+)
+from strawberry.subscriptions.protocols.graphql_ws import GQL_COMPLETE, GQL_DATA
+from strawberry.subscriptions.protocols.graphql_ws.types import (
+    OperationMessage,
+    StartPayload,
+)
+from strawberry.types.graphql import OperationType
+
+from coniql.clock import sim_clock
+from coniql.metrics import (
+    DROPPED_UPDATES,
+    MetricsGraphQLTransportWSHandler,
+    MetricsGraphQLWSHandler,
+)
+from coniql.types import BinaryFrame
+
+# How many results a subscriber can fall behind before it is sent a snapshot
+SUBSCRIBER_BUFFER = 10
+
+
+class EncodedResult(NamedTuple):
+    # The JSON encoded payload
+    payload: str
+    # Binary websocket frames to send before the payload, which refers to them
+    # by their index in this list
+    frames: List[bytes]
+
+
+def encode_result(result: ExecutionResult) -> EncodedResult:
+    """JSON encode the payload sent to clients for a single result, taking any
+    BinaryFrames out of it to be sent as binary websocket frames"""
+    payload: Dict[str, Any] = {"data": result.data}
+    if result.errors:
+        payload["errors"] = [err.formatted for err in result.errors]
+    frames: List[bytes] = []
+    # {id(frame): index} so a frame selected twice is only sent once
+    indexes: Dict[int, int] = {}
+
+    def encode_frame(obj: Any) -> int:
+        if not isinstance(obj, BinaryFrame):
+            raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+        if id(obj) not in indexes:
+            indexes[id(obj)] = len(frames)
+            frames.append(obj.data)
+        return indexes[id(obj)]
+
+    return EncodedResult(json.dumps(payload, default=encode_frame), frames)
+
+
+class ResultQueue:
+    """The encoded results waiting to be sent to one subscriber. At most maxsize
+    are held. As each result only contains what changed, if more arrive the
+    whole backlog is dropped and the subscriber is marked stale, to be sent a
+    fresh complete result instead. The sim clock is held until the subscriber
+    has caught up, so virtual time waits for it"""
+
+    def __init__(self, maxsize: int = SUBSCRIBER_BUFFER) -> None:
+        self.results: Deque[EncodedResult] = deque()
+        self.maxsize = maxsize
+        self.stale = False
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def put(self, result: EncodedResult):
+        if len(self.results) >= self.maxsize:
+            DROPPED_UPDATES.add({"type": "subscription"}, len(self.results) + 1)
+            self.results.clear()
+            self.stale = True
+        elif not self.stale:
+            self.results.append(result)
+        else:
+            DROPPED_UPDATES.inc({"type": "subscription"})
+        sim_clock.hold(self)
+        self.ready.set()
+
+    def get_nowait(self) -> EncodedResult:
+        result = self.results.popleft()
+        self.check_caught_up()
+        return result
+
+    def check_caught_up(self):
+        """Release the sim clock if there is nothing left to send"""
+        if not (self.results or self.stale):
+            sim_clock.release(self)
+
+    def close(self):
+        """Mark that there will be no more results"""
+        self.closed = True
+        self.ready.set()
+
+    async def wait(self):
+        """Wait until there is a result, the queue is stale, or it is closed"""
+        while not (self.results or self.stale or self.closed):
+            self.ready.clear()
+            await self.ready.wait()
+
+
+def is_shareable(
+    query: str, variables: Optional[Dict[str, Any]], operation_name: Optional[str]
+) -> bool:
+    """Whether a subscriber joining an operation late, or falling behind, can
+    catch up from the first result of a fresh execution. This is only so if
+    every root field is a subscribeChannel without delta. The results of
+    subscribeChannels after the first may only hold some of its channels, and
+    deltas are relative to the arrays the subscriber was sent before"""
+    try:
+        document = parse(query)
+    except GraphQLError:
+        return False
+    for definition in document.definitions:
+        if isinstance(definition, OperationDefinitionNode) and (
+            operation_name is None
+            or (definition.name and definition.name.value == operation_name)
+        ):
+            break
+    else:
+        return False
+    for selection in definition.selection_set.selections:
+        if not isinstance(selection, FieldNode):
+            return False
+        if selection.name.value != "subscribeChannel":
+            return False
+        for argument in selection.arguments:
+            if argument.name.value == "delta" and value_from_ast_untyped(
+                argument.value, variables
+            ):
+                return False
+    return True
+
+
+class SharedOperation:
+    """A subscription operation executed once on behalf of all its subscribers,
+    putting each encoded result on every subscriber's queue"""
+
+    def __init__(
+        self,
+        schema: BaseSchema,
+        query: str,
+        variables: Optional[Dict[str, Any]],
+        operation_name: Optional[str],
+    ):
+        self.schema = schema
+        self.query = query
+        self.variables = variables
+        self.operation_name = operation_name
+        self.queues: Set[ResultQueue] = set()
+        # Set once the first result has been sent, after which new subscribers
+        # need a complete result of their own before the shared updates
+        self.started = False
+        self.error: Optional[Exception] = None
+        self.task = asyncio.create_task(self.pump())
+
+    async def execute(self):
+        return await self.schema.subscribe(
+            query=self.query,
+            variable_values=self.variables,
+            operation_name=self.operation_name,
+        )
+
+    async def pump(self):
+        try:
+            source = await self.execute()
+            if isinstance(source, ExecutionResult):
+                self.broadcast(source)
+            else:
+                async for result in cast(AsyncIterator[ExecutionResult], source):
+                    self.broadcast(result)
+        except Exception as e:
+            self.error = e
+        finally:
+            for queue in self.queues:
+                queue.close()
+
+    def broadcast(self, result: ExecutionResult):
+        payload = encode_result(result)
+        if result.errors:
+            self.schema.process_errors(result.errors)
+        self.started = True
+        for queue in self.queues:
+            queue.put(payload)
+
+    async def snapshot(self) -> Optional[EncodedResult]:
+        """Execute the operation separately to get its first, complete result"""
+        source = await self.execute()
+        if isinstance(source, ExecutionResult):
+            return encode_result(source)
+        try:
+            return encode_result(await source.__anext__())
+        except StopAsyncIteration:
+            return None
+        finally:
+            await source.aclose()
+
+
+class SharedOperations:
+    """Executes each distinct subscription operation only once, however many
+    websocket clients have sent it, and hands out the JSON encoded payload and
+    binary frames of each result so they can be sent to all of them without
+    re-encoding.
+
+    Operations are the same if their query, variables and operation name match.
+    The channel ids are part of these, so only identical subscriptions share.
+    Operations that are not shareable are executed for each subscriber."""
+
+    def __init__(self, schema: BaseSchema):
+        self.schema = schema
+        # {key: operation}
+        self.operations: Dict[str, SharedOperation] = {}
+
+    async def subscribe(
+        self,
+        query: str,
+        variables: Optional[Dict[str, Any]] = None,
+        operation_name: Optional[str] = None,
+    ) -> AsyncIterator[EncodedResult]:
+        """Subscribe to an operation, yielding the encoded payload of each result.
+        Raises any error that ends the operation"""
+        if not is_shareable(query, variables, operation_name):
+            async for payload in self.subscribe_alone(query, variables, operation_name):
+                yield payload
+            return
+        key = json.dumps([query, variables, operation_name], sort_keys=True)
+        operation = self.operations.get(key)
+        if operation is None or operation.task.done():
+            operation = SharedOperation(self.schema, query, variables, operation_name)
+            self.operations[key] = operation
+        queue = ResultQueue()
+        # A late subscriber needs a complete result before the shared updates
+        queue.stale = operation.started
+        # Join before asking for a snapshot so no update is missed in between
+        operation.queues.add(queue)
+        try:
+            while True:
+                await queue.wait()
+                if queue.stale:
+                    queue.stale = False
+                    snapshot = await operation.snapshot()
+                    queue.check_caught_up()
+                    if snapshot is not None:
+                        yield snapshot
+                elif queue.results:
+                    yield queue.get_nowait()
+                else:
+                    if operation.error:
+                        raise operation.error
+                    return
+        finally:
+            operation.queues.discard(queue)
+            sim_clock.release(queue)
+            if not operation.queues and self.operations.get(key) is operation:
+                del self.operations[key]
+                operation.task.cancel()
+
+    async def subscribe_alone(
+        self,
+        query: str,
+        variables: Optional[Dict[str, Any]] = None,
+        operation_name: Optional[str] = None,
+    ) -> AsyncIterator[EncodedResult]:
+        """Execute an operation for a single subscriber, yielding the encoded
+        payload of each result as the subscriber is ready for it"""
+        source = await self.schema.subscribe(
+            query=query, variable_values=variables, operation_name=operation_name
+        )
+        if isinstance(source, ExecutionResult):
+            # The operation failed before it started
+            if source.errors:
+                self.schema.process_errors(source.errors)
+            yield encode_result(source)
+            return
+        try:
+            async for result in cast(AsyncIterator[ExecutionResult], source):
+                if result.errors:
+                    self.schema.process_errors(result.errors)
+                yield encode_result(result)
+        finally:
+            await source.aclose()
+
+
+shared_operations: "WeakKeyDictionary[BaseSchema, SharedOperations]" = (
+    WeakKeyDictionary()
+)
+
+
+def get_shared_operations(schema: BaseSchema) -> SharedOperations:
+    """Get the SharedOperations for a schema, creating them on first use"""
+    if schema not in shared_operations:
+        shared_operations[schema] = SharedOperations(schema)
+    return shared_operations[schema]
+
+
+class SharedGraphQLTransportWSHandler(MetricsGraphQLTransportWSHandler):
+    """Sends subscription results from SharedOperations, so clients subscribing
+    to the same operation share its execution and JSON encoding"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Held while sending a result, so its binary frames are not separated
+        # from it by those of another operation
+        self.send_lock = asyncio.Lock()
+        # {operation_id: payload} until the operation task starts
+        self.payloads: Dict[str, SubscribeMessagePayload] = {}
+
+    async def handle_subscribe(self, message: SubscribeMessage) -> None:
+        if message.id not in self.operations:
+            self.payloads[message.id] = message.payload
+        await super().handle_subscribe(message)
+        if message.id not in self.operations:
+            # Rejected, so no operation task will take the payload
+            self.payloads.pop(message.id, None)
+
+    async def send_result(self, prefix: str, result: EncodedResult) -> None:
+        async with self.send_lock:
+            for frame in result.frames:
+                await self._ws.send_bytes(frame)
+            await self._ws.send_str(prefix + result.payload + "}")
+
+    async def handle_async_results(
+        self, result_source: AsyncGenerator, operation: Operation
+    ) -> None:
+        payload = self.payloads.pop(operation.id)
+        if operation.operation_type != OperationType.SUBSCRIPTION:
+            await super().handle_async_results(result_source, operation)
+            return
+        # Never iterated, so closing it does not start a subscription
+        await result_source.aclose()
+        shared = get_shared_operations(self.schema)
+        prefix = '{"id": %s, "type": "next", "payload": ' % json.dumps(operation.id)
+        try:
+            async for result in shared.subscribe(
+                payload.query, payload.variables, payload.operationName
+            ):
+                if operation.completed:
+                    return
+                await self.send_result(prefix, result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            error = GraphQLError(str(error), original_error=error)
+            error_message = ErrorMessage(id=operation.id, payload=[error.formatted])
+            await operation.send_message(error_message)
+            self.schema.process_errors([error])
+
+
+class SharedGraphQLWSHandler(MetricsGraphQLWSHandler):
+    """Sends subscription results from SharedOperations, so clients subscribing
+    to the same operation share its execution and JSON encoding"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Held while sending a result, so its binary frames are not separated
+        # from it by those of another operation
+        self.send_lock = asyncio.Lock()
+        # {operation_id: payload} until the operation task starts
+        self.payloads: Dict[str, StartPayload] = {}
+
+    async def handle_start(self, message: OperationMessage) -> None:
+        operation_id = message["id"]
+        self.payloads[operation_id] = cast(StartPayload, message["payload"])
+        await super().handle_start(message)
+        if operation_id not in self.tasks:
+            # Rejected, so no operation task will take the payload
+            self.payloads.pop(operation_id, None)
+
+    async def send_result(self, prefix: str, result: EncodedResult) -> None:
+        async with self.send_lock:
+            for frame in result.frames:
+                await self._ws.send_bytes(frame)
+            await self._ws.send_str(prefix + result.payload + "}")
+
+    async def handle_async_results(
+        self, result_source: AsyncGenerator, operation_id: str
+    ) -> None:
+        payload = self.payloads.pop(operation_id)
+        # Never iterated, so closing it does not start a subscription
+        await result_source.aclose()
+        shared = get_shared_operations(self.schema)
+        prefix = '{"type": "data", "id": %s, "payload": ' % json.dumps(operation_id)
+        try:
+            async for result in shared.subscribe(
+                payload["query"],
+                payload.get("variables"),
+                payload.get("operationName"),
+            ):
+                await self.send_result(prefix, result)
+        except asyncio.CancelledError:
+            # CancelledErrors are expected during task cleanup.
+            pass
+        except Exception as error:
+            error = GraphQLError(str(error), original_error=error)
+            await self.send_message(
+                GQL_DATA,
+                operation_id,
+                {"data": None, "errors": [error.formatted]},
+            )
+            self.schema.process_errors([error])
+
+        await self.send_message(GQL_COMPLETE, operation_id, None)
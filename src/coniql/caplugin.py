@@ -1,17 +1,30 @@
-# Support type hints for asyncio.Queue
-from __future__ import annotations
-
 import asyncio
 import logging
+import sys
+import time
 import uuid
-from asyncio import Event, Queue
+from asyncio import Event
 from collections import defaultdict
 from dataclasses import dataclass
 from enum import Enum
-from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Collection,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+)
 
 from aioca import (
+    DBE_ALARM,
+    DBE_LOG,
     DBE_PROPERTY,
+    DBE_VALUE,
     FORMAT_CTRL,
     FORMAT_TIME,
     CANothing,
@@ -23,9 +36,23 @@ from aioca import (
 )
 from aioca.types import AugmentedValue
 
-from coniql.coniql_schema import Widget
-from coniql.metrics import update_subscription_metrics
-from coniql.plugin import Plugin, PutValue
+from coniql.coniql_schema import ChannelEvent, Widget
+from coniql.metrics import (
+    FIRST_UPDATE_TIME,
+    MONITOR_LINGER_EXPIRIES,
+    MONITOR_LINGER_HITS,
+    PV_REGISTRY_BYTES,
+    PV_REGISTRY_SIZE,
+    update_subscription_metrics,
+)
+from coniql.plugin import (
+    CHANNEL_FIELDS,
+    ChannelUpdates,
+    Deadband,
+    DeadbandFilter,
+    Plugin,
+    PutValue,
+)
 from coniql.types import (
     Channel,
     ChannelDisplay,
@@ -41,6 +68,34 @@ from coniql.types import (
 coniql_logger = logging.getLogger(__name__)
 TRANSPORT = "ca://"
 
+# How long to keep camonitors open after the last subscriber has gone
+CA_MONITOR_LINGER = 10
+
+
+# How long to reuse the control metadata and write access fetched for a PV
+CA_METADATA_TTL = 60
+
+# The events a value camonitor is opened for unless a subscription asks otherwise
+CA_DEFAULT_EVENTS = DBE_VALUE | DBE_ALARM
+
+# The CA event mask bit for each kind of event a subscription can ask for
+CA_EVENT_MASKS = {
+    ChannelEvent.VALUE: DBE_VALUE,
+    ChannelEvent.ARCHIVE: DBE_LOG,
+    ChannelEvent.ALARM: DBE_ALARM,
+}
+
+
+def event_mask(events: Optional[Collection[ChannelEvent]]) -> int:
+    """Make the CA event mask for a value camonitor from the events asked for"""
+    if events is None:
+        return CA_DEFAULT_EVENTS
+    assert events, "At least one event must be given"
+    mask = 0
+    for event in events:
+        mask |= CA_EVENT_MASKS[event]
+    return mask
+
 
 class CAChannelMaker:
     def __init__(self, name, writeable: bool):
@@ -186,25 +241,112 @@ class CAChannel(Channel):
 @dataclass
 class CallbackContext:
     callback: Callable[[Channel], None]
+    # The top level Channel fields the subscriber wants updates to
+    fields: Collection[str] = CHANNEL_FIELDS
+    # Set once the subscriber has been sent its complete first update
+    ready: bool = False
+
+
+# Channel fields that come from the FORMAT_TIME value
+TIME_FIELDS = {"value", "time", "status"}
+# Channel fields that need the FORMAT_CTRL value
+META_FIELDS = {"value", "display"}
+
+
+class MonitorKey(NamedTuple):
+    """Identifies a set of camonitors that can be shared between subscriptions"""
+
+    pv: str
+    # The event mask of the value camonitor
+    events: int = CA_DEFAULT_EVENTS
+    # How many array elements the camonitors fetch, 0 meaning all of them
+    elements: int = 0
 
 
 @dataclass
 class SubscriptionData:
-    pv: str
+    key: MonitorKey
 
     time_value: Optional[AugmentedValue]
-    time_monitor: Subscription
+    # Only opened if a subscriber wants TIME_FIELDS
+    time_monitor: Optional[Subscription]
+    time_received: Event
 
     meta_value: Optional[AugmentedValue]
-    meta_monitor: Subscription
+    # Only opened if a subscriber wants the display, as the value can be
+    # formatted from a single FORMAT_CTRL caget
+    meta_monitor: Optional[Subscription]
+    meta_received: Event
 
-    all_values_received: Event
+    # Set once we know whether the channel is writeable
+    info_received: Event
 
     callbacks: Dict[str, CallbackContext]
     maker: CAChannelMaker
 
     subscribers: int
 
+    # Set while the monitors are kept open with no subscribers
+    linger: Optional[asyncio.TimerHandle] = None
+
+    # Set while getting the FORMAT_CTRL value without a monitor
+    meta_task: Optional[asyncio.Task] = None
+    # When the FORMAT_CTRL value got without a monitor should be got again
+    meta_expires: float = 0.0
+
+    @property
+    def pv(self) -> str:
+        return self.key.pv
+
+    @property
+    def monitors(self) -> List[Subscription]:
+        return [m for m in (self.time_monitor, self.meta_monitor) if m is not None]
+
+
+def value_nbytes(value: Optional[AugmentedValue]) -> int:
+    """Approximate memory held by a value, dominated by the data for arrays"""
+    if value is None:
+        return 0
+    elif hasattr(value, "nbytes"):
+        return value.nbytes
+    else:
+        return sys.getsizeof(value)
+
+
+@dataclass
+class CAMetadata:
+    meta_value: AugmentedValue
+    writeable: bool
+    expires: float
+
+
+class CAMetadataCache:
+    """Remembers the FORMAT_CTRL value and write access of PVs for `ttl` seconds,
+    as these rarely change but take two CA requests to fetch"""
+
+    def __init__(self, ttl: float = CA_METADATA_TTL) -> None:
+        self.ttl = ttl
+        # Entries in order of expiry, as they are all given the same ttl
+        self.metadata: Dict[str, CAMetadata] = {}
+
+    def get(self, pv: str) -> Optional[CAMetadata]:
+        metadata = self.metadata.get(pv)
+        if metadata and metadata.expires > time.monotonic():
+            return metadata
+        return None
+
+    def put(self, pv: str, meta_value: AugmentedValue, writeable: bool) -> None:
+        self.invalidate(pv)
+        now = time.monotonic()
+        if self.ttl > 0 and meta_value.ok:
+            self.metadata[pv] = CAMetadata(meta_value, writeable, now + self.ttl)
+        # Drop expired entries so PVs that are never asked for again are forgotten
+        while self.metadata and next(iter(self.metadata.values())).expires <= now:
+            del self.metadata[next(iter(self.metadata))]
+
+    def invalidate(self, pv: str) -> None:
+        self.metadata.pop(pv, None)
+
 
 class DataEnum(Enum):
     TIME_VALUE = "time_value"
@@ -213,199 +355,468 @@ class DataEnum(Enum):
 
 class CASubscriptionManager:
     """Pools camonitor requests across all subscriptions, ensuring we only have one
-    active subscription for each PV."""
+    active subscription for each PV, value event mask and array element count.
 
-    def __init__(self) -> None:
-        self.pvs: Dict[str, SubscriptionData] = {}
+    Monitors are kept open for `linger` seconds after the last subscriber has gone,
+    so a subscriber that comes back in that time gets the cached values at once.
+    After that they are closed and everything about them is forgotten, so only
+    PVs with open monitors are held.
+
+    Metadata fetched by gets is cached for `metadata_ttl` seconds, or until a
+    monitor sees it change."""
+
+    def __init__(
+        self,
+        linger: float = CA_MONITOR_LINGER,
+        metadata_ttl: float = CA_METADATA_TTL,
+    ) -> None:
+        self.linger = linger
+        self.metadata = CAMetadataCache(metadata_ttl)
+        self.pvs: Dict[MonitorKey, SubscriptionData] = {}
         self.metrics_task: Optional[asyncio.Task] = None
-        self.locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.locks: Dict[MonitorKey, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # Set of asyncio tasks running, so they are not garbage collected
+        self.task_references: Set[asyncio.Task[Any]] = set()
+
+    def __start_task(self, coro) -> asyncio.Task[Any]:
+        """Run coro in a task, holding a reference to it until it is done"""
+        task = asyncio.create_task(coro)
+        self.task_references.add(task)
+        task.add_done_callback(self.task_references.discard)
+        return task
 
     async def update_metrics(self) -> None:
-        value_monitor_last_dropped: Dict[str, int] = defaultdict(int)
-        meta_monitor_last_dropped: Dict[str, int] = defaultdict(int)
+        value_monitor_last_dropped: Dict[MonitorKey, int] = defaultdict(int)
+        meta_monitor_last_dropped: Dict[MonitorKey, int] = defaultdict(int)
 
         while True:
+            for key in list(value_monitor_last_dropped):
+                if key not in self.pvs:
+                    # Closed, so will never be reported again
+                    del value_monitor_last_dropped[key]
+                    del meta_monitor_last_dropped[key]
             for x in self.pvs.values():
-                value_monitor_last_dropped[x.pv] = update_subscription_metrics(
-                    x.time_monitor, value_monitor_last_dropped[x.pv], {"type": "value"}
-                )
-                meta_monitor_last_dropped[x.pv] = update_subscription_metrics(
-                    x.meta_monitor, meta_monitor_last_dropped[x.pv], {"type": "meta"}
-                )
+                if x.time_monitor:
+                    value_monitor_last_dropped[x.key] = update_subscription_metrics(
+                        x.time_monitor,
+                        value_monitor_last_dropped[x.key],
+                        {"type": "value"},
+                    )
+                if x.meta_monitor:
+                    meta_monitor_last_dropped[x.key] = update_subscription_metrics(
+                        x.meta_monitor,
+                        meta_monitor_last_dropped[x.key],
+                        {"type": "meta"},
+                    )
+            self.update_registry_metrics()
             await asyncio.sleep(10)  # Metrics only need updating infrequently
 
-    def __callback(self, pv: str, key: DataEnum, v: AugmentedValue):
-        if pv not in self.pvs:
+    def update_registry_metrics(self) -> None:
+        """Report how many PVs are held, and how much memory their values use"""
+        PV_REGISTRY_SIZE.set({}, len(self.pvs))
+        PV_REGISTRY_BYTES.set(
+            {},
+            sum(
+                value_nbytes(x.time_value) + value_nbytes(x.meta_value)
+                for x in self.pvs.values()
+            ),
+        )
+
+    def __callback(self, monitor_key: MonitorKey, key: DataEnum, v: AugmentedValue):
+        if monitor_key not in self.pvs:
             return
 
-        data = self.pvs[pv]
+        data = self.pvs[monitor_key]
 
         if key == DataEnum.TIME_VALUE:
             data.time_value = v
+            data.time_received.set()
+            if (
+                data.meta_monitor is None
+                and data.meta_task is None
+                and data.meta_received.is_set()
+                and self.metadata.ttl > 0
+                and time.monotonic() >= data.meta_expires
+            ):
+                # Pick up changes to how the value should be formatted
+                data.meta_task = self.__start_task(self.__get_meta(data))
+            channel = data.maker.channel_from_update(time_value=data.time_value)
+            fields = TIME_FIELDS
         elif key == DataEnum.META_VALUE:
             data.meta_value = v
+            data.meta_received.set()
+            self.metadata.invalidate(data.pv)
+            channel = data.maker.channel_from_update(meta_value=data.meta_value)
+            fields = META_FIELDS
         else:
             raise KeyError(f"Unrecognised key {key}")
 
-        # Ensure we have both values before creating the channel
-        # This ensures the first update sent to the client has both
-        # values and metadata
-        if data.time_value is None or data.meta_value is None:
-            return
-
-        if not data.all_values_received.is_set():
-            # The first subscription return is handled as part of the
-            # `subscribe` function, which is blocked waiting on this event
-            data.all_values_received.set()
-        else:
-            # Otherwise, construct the appropriate channel and call all callbacks
-            if key == DataEnum.TIME_VALUE:
-                channel = data.maker.channel_from_update(time_value=data.time_value)
-            elif key == DataEnum.META_VALUE:
-                channel = data.maker.channel_from_update(meta_value=data.meta_value)
-
-            for context in data.callbacks.values():
+        # Subscribers still waiting for their first update are sent it as part of
+        # the `subscribe` function, and it will include this update
+        for context in data.callbacks.values():
+            if context.ready and fields.intersection(context.fields):
                 context.callback(channel)
 
     async def subscribe(
-        self, pv: str, callback: Callable[[Channel], None], callback_key: str
+        self,
+        pv: str,
+        callback: Callable[[Channel], None],
+        callback_key: str,
+        fields: Collection[str] = CHANNEL_FIELDS,
+        events: int = CA_DEFAULT_EVENTS,
+        count: int = 0,
     ):
-        """Subscribe to the given PV.
+        """Subscribe to the given PV, for updates to the given top level Channel
+        fields. Only the monitors those fields need are opened, and they are shared
+        with other subscribers to the PV that ask for the same event mask, which is
+        applied to the value camonitor, and the same count of array elements.
 
-        This function will block until both a time and meta value update has been
-        received from the PV. Once the data is received the provided callback will be
-        called immediately, with a Channel object that contains both time and meta
-        values.
+        This function will block until the values needed for the fields have been
+        received from the PV. Once the data is received the provided callback will
+        be called immediately, with a Channel object that contains all of them.
 
         Caller must provide a key that will be associated with the callback. This same
-        key must be passed to the `unsubscribe` function."""
-        callback_context = CallbackContext(callback)
+        key, event mask and count must be passed to the `unsubscribe` function."""
+        start = time.monotonic()
+        callback_context = CallbackContext(callback, fields)
+        key = MonitorKey(pv, events, count)
 
         # Restrict access to the shared dictionary - otherwise issues arise if two
         # clients attempt to subscribe to the same PV at the same time
-        async with self.locks[pv]:
+        async with self.locks[key]:
             # One-time async init across all subscriptions
             if self.metrics_task is None:
                 self.metrics_task = asyncio.create_task(self.update_metrics())
 
             # Either this PV is new or we've previously closed the monitors.
-            if (
-                pv not in self.pvs
-                or self.pvs[pv].meta_monitor.state == Subscription.CLOSED
-            ):
-                # A specific request required for whether the channel is writeable.
-                # This will not be updated, so wait until a callback is received
-                # before making the request when the channel is likely be connected.
-                # NOTE: This MUST happen before the camonitors are created, otherwise we
-                # run the risk of the initial monitor callbacks happening while we're
-                # waiting for this cainfo call to return.
-                writeable = True
-                try:
-                    info = await cainfo(pv)
-                    writeable = info.write
-                except CANothing:
-                    # Unlikely, but allow subscriptions to continue.
-                    pass
-
-                # Initialize camonitors for this PV
-                value_monitor = camonitor(
-                    pv,
-                    lambda v: self.__callback(pv, DataEnum.TIME_VALUE, v),
-                    format=FORMAT_TIME,
-                    notify_disconnect=True,
+            if key not in self.pvs:
+                monitors = "new"
+                # Writeable until we know better, as that is what we assume if
+                # the write access can't be found
+                maker = CAChannelMaker(pv, True)
+
+                data = self.pvs[key] = SubscriptionData(
+                    key=key,
+                    time_value=None,
+                    time_monitor=None,
+                    time_received=Event(),
+                    meta_value=None,
+                    meta_monitor=None,
+                    meta_received=Event(),
+                    info_received=Event(),
+                    callbacks={callback_key: callback_context},
+                    maker=maker,
+                    subscribers=1,
                 )
 
+                # Whether the channel is writeable is not monitored, so look it up
+                # while the camonitors connect. This is done in a separate task so
+                # it completes even if this subscriber goes away.
+                self.__start_task(self.__get_writeable(data))
+
+            else:
+                monitors = "open"
+                data = self.pvs[key]
+                if data.linger:
+                    # Monitors were kept open waiting for a subscriber like us
+                    data.linger.cancel()
+                    data.linger = None
+                    MONITOR_LINGER_HITS.inc({})
+                data.subscribers += 1
+                data.callbacks[callback_key] = callback_context
+
+            # Open any monitors we need that earlier subscribers didn't
+            waits = [data.info_received.wait()]
+            if TIME_FIELDS.intersection(fields):
+                if data.time_monitor is None:
+                    monitors = "new"
+                    data.time_monitor = camonitor(
+                        pv,
+                        lambda v: self.__callback(key, DataEnum.TIME_VALUE, v),
+                        events=events,
+                        format=FORMAT_TIME,
+                        count=count,
+                        notify_disconnect=True,
+                    )
+                waits.append(data.time_received.wait())
+            if "display" in fields and data.meta_monitor is None:
+                monitors = "new"
                 # Monitor PV only for property changes. For EPICS < 3.15 this monitor
                 # will update once on connection but will not subsequently be triggered.
                 # https://github.com/dls-controls/coniql/issues/22#issuecomment-863899258
-                meta_monitor = camonitor(
+                data.meta_monitor = camonitor(
                     pv,
-                    lambda v: self.__callback(pv, DataEnum.META_VALUE, v),
+                    lambda v: self.__callback(key, DataEnum.META_VALUE, v),
                     events=DBE_PROPERTY,
                     format=FORMAT_CTRL,
+                    count=count,
                 )
+            elif META_FIELDS.intersection(fields) and not (
+                data.meta_monitor or data.meta_task or data.meta_received.is_set()
+            ):
+                # Only the value needs formatting, which rarely changes
+                data.meta_task = self.__start_task(self.__get_meta(data))
+            if META_FIELDS.intersection(fields):
+                waits.append(data.meta_received.wait())
 
-                maker = CAChannelMaker(pv, writeable)
-
-                self.pvs[pv] = SubscriptionData(
-                    pv=pv,
-                    time_value=None,
-                    time_monitor=value_monitor,
-                    meta_value=None,
-                    meta_monitor=meta_monitor,
-                    all_values_received=Event(),
-                    callbacks={callback_key: callback_context},
-                    maker=maker,
-                    subscribers=1,
-                )
-
-            else:
-                self.pvs[pv].subscribers += 1
-                self.pvs[pv].callbacks[callback_key] = callback_context
-
-            # Construct and send a channel with both time and meta values
-            data = self.pvs[pv]
-            await data.all_values_received.wait()
+            # Construct and send a channel with all the values we need
+            await asyncio.gather(*waits)
             channel = data.maker.channel_from_update(
-                time_value=data.time_value,
+                time_value=data.time_value if data.time_monitor else None,
                 meta_value=data.meta_value,
                 send_quality=True,
             )
+            callback_context.ready = True
             callback_context.callback(channel)
+            FIRST_UPDATE_TIME.observe({"monitors": monitors}, time.monotonic() - start)
 
-    def unsubscribe(self, pv: str, callback_key: str) -> None:
-        """Unsubscribe from the given PV. The callback key must be provided and must
-        match the one passed to the `subscribe` function."""
-        data = self.pvs[pv]
+    async def __get_writeable(self, data: SubscriptionData) -> None:
+        try:
+            info = await cainfo(data.pv)
+            data.maker.writeable = info.write
+        except CANothing:
+            # Unlikely, but allow subscriptions to continue.
+            pass
+        finally:
+            data.info_received.set()
+
+    async def __get_meta(self, data: SubscriptionData) -> None:
+        metadata = self.metadata.get(data.pv)
+        try:
+            if metadata:
+                meta_value = metadata.meta_value
+            else:
+                # Wait however long it takes to connect, like a monitor would
+                meta_value = await caget(
+                    data.pv, format=FORMAT_CTRL, count=data.key.elements, timeout=None
+                )
+            if not data.meta_received.is_set():
+                data.meta_value = meta_value
+            elif data.meta_monitor is None:
+                # Format the values that follow with it
+                data.meta_value = meta_value
+                data.maker.channel_from_update(meta_value=meta_value)
+        except CANothing:
+            # Values will be sent without formatting rather than not at all
+            pass
+        finally:
+            data.meta_task = None
+            data.meta_expires = time.monotonic() + self.metadata.ttl
+            data.meta_received.set()
+
+    def live_data(self, pv: str, count: int = 0) -> Optional[SubscriptionData]:
+        """Return the data for the given PV if its value and metadata monitors are
+        open for the default events and connected, and its write access is known.
+        The monitors must fetch the given count of array elements, or all of them"""
+        data = self.pvs.get(MonitorKey(pv, elements=count))
+        if data is None and count:
+            data = self.pvs.get(MonitorKey(pv))
+        if (
+            data
+            and data.time_monitor
+            and data.time_monitor.state == Subscription.OPEN
+            and data.time_value is not None
+            and data.time_value.ok
+            and data.meta_monitor
+            and data.meta_monitor.state == Subscription.OPEN
+            and data.meta_value is not None
+            and data.info_received.is_set()
+        ):
+            return data
+        return None
+
+    def unsubscribe(
+        self,
+        pv: str,
+        callback_key: str,
+        events: int = CA_DEFAULT_EVENTS,
+        count: int = 0,
+    ) -> None:
+        """Unsubscribe from the given PV. The callback key, event mask and count
+        must be provided and must match those passed to the `subscribe` function.
+        Unsubscribing a key that never completed its `subscribe` call is a no-op."""
+        data = self.pvs.get(MonitorKey(pv, events, count))
+        if data is None or callback_key not in data.callbacks:
+            return
 
         data.subscribers -= 1
 
         data.callbacks.pop(callback_key)
 
         if data.subscribers == 0:
-            data.time_monitor.close()
-            data.meta_monitor.close()
+            if self.linger > 0:
+                data.linger = asyncio.get_running_loop().call_later(
+                    self.linger, self.__expire, data
+                )
+            else:
+                self.__close(data)
+
+    def __expire(self, data: SubscriptionData) -> None:
+        """Close the monitors of a PV that has had no subscribers for the whole
+        linger period"""
+        data.linger = None
+        MONITOR_LINGER_EXPIRIES.inc({})
+        self.__close(data)
+
+    def __close(self, data: SubscriptionData) -> None:
+        for monitor in data.monitors:
+            monitor.close()
+        if data.meta_task:
+            data.meta_task.cancel()
+        # Forget everything about them, so the values are not held in memory
+        del self.pvs[data.key]
+        # A held lock means a subscribe is in progress and still needs it
+        lock = self.locks.get(data.key)
+        if lock and not lock.locked():
+            del self.locks[data.key]
+
+
+def updates_callback(
+    updates: ChannelUpdates, pv: str, deadband: Optional[Deadband] = None
+) -> Callable[[Channel], None]:
+    """Make a callback that puts Channel updates for pv, dropping any within the
+    deadband before they are merged or sent"""
+    if deadband is None:
+        return lambda channel: updates.put(pv, channel)
+    deadband_filter = DeadbandFilter(deadband)
+
+    def callback(channel: Channel):
+        if deadband_filter.passes(channel):
+            updates.put(pv, channel)
+
+    return callback
 
 
 class CAPlugin(Plugin):
     def __init__(self):
         self.subscription_manager = CASubscriptionManager()
 
-    async def get_channel(self, pv: str, timeout: float) -> Channel:
-        time_value, meta_value, info = await asyncio.gather(
-            caget(pv, format=FORMAT_TIME, timeout=timeout),
-            caget(pv, format=FORMAT_CTRL, timeout=timeout),
-            cainfo(pv, timeout=timeout),
+    async def get_channel(
+        self,
+        pv: str,
+        timeout: float,
+        fresh: bool = False,
+        fields: Collection[str] = CHANNEL_FIELDS,
+        count: int = 0,
+    ) -> Channel:
+        manager = self.subscription_manager
+        data = None if fresh else manager.live_data(pv, count)
+        if data:
+            # Monitors are already keeping these values up to date
+            maker = CAChannelMaker(pv, data.maker.writeable)
+            return maker.channel_from_update(
+                time_value=data.time_value, meta_value=data.meta_value
+            )
+        metadata = None if fresh else manager.metadata.get(pv)
+        # Only make the CA requests needed for the fields asked for
+        requests: Dict[str, Any] = {}
+        if {"time", "status"}.intersection(fields) or (metadata and "value" in fields):
+            # Time and alarm status, and the value if we can already format it
+            requests["time"] = caget(
+                pv, format=FORMAT_TIME, count=count, timeout=timeout
+            )
+        if not metadata:
+            if {"value", "display"}.intersection(fields):
+                # Display metadata, along with a value formatted using it
+                requests["meta"] = caget(
+                    pv, format=FORMAT_CTRL, count=count, timeout=timeout
+                )
+            if "status" in fields:
+                requests["info"] = cainfo(pv, timeout=timeout)
+        if not requests:
+            # Still check the PV is there, so a missing one is an error
+            requests["time"] = caget(
+                pv, format=FORMAT_TIME, count=count, timeout=timeout
+            )
+        results = dict(zip(requests, await asyncio.gather(*requests.values())))
+        if metadata:
+            meta_value, writeable = metadata.meta_value, metadata.writeable
+        else:
+            meta_value = results.get("meta")
+            writeable = results["info"].write if "info" in results else True
+            if meta_value is not None and "info" in results:
+                manager.metadata.put(pv, meta_value, writeable)
+        maker = CAChannelMaker(pv, writeable)
+        return maker.channel_from_update(
+            time_value=results.get("time"), meta_value=meta_value
         )
-        maker = CAChannelMaker(pv, info.write)
-        return maker.channel_from_update(time_value=time_value, meta_value=meta_value)
 
     async def put_channels(
         self, pvs: List[str], values: Sequence[PutValue], timeout: float
     ):
         await caput(pvs, values, timeout=timeout)
 
-    async def subscribe_channel(self, pv: str) -> AsyncIterator[Channel]:
-        value: Queue[Channel] = asyncio.Queue(maxsize=1)
+    async def subscribe_channel(
+        self,
+        pv: str,
+        min_interval: float = 0.0,
+        fields: Collection[str] = CHANNEL_FIELDS,
+        deadband: Optional[Deadband] = None,
+        events: Optional[Collection[ChannelEvent]] = None,
+        count: int = 0,
+    ) -> AsyncIterator[Channel]:
+        updates = ChannelUpdates(min_interval)
+        mask = event_mask(events)
 
         # Generate unique key for this subscription
         uid = str(uuid.uuid4())
 
-        def __callback(channel: Channel):
-            # Ensure queue is empty
+        await self.subscription_manager.subscribe(
+            pv, updates_callback(updates, pv, deadband), uid, fields, mask, count
+        )
+
+        try:
             while True:
-                try:
-                    value.get_nowait()
-                except asyncio.QueueEmpty:
-                    break
+                yield (await updates.get())[pv]
+
+        finally:
+            self.subscription_manager.unsubscribe(pv, uid, mask, count)
+
+    async def subscribe_channels(
+        self,
+        pvs: List[str],
+        min_interval: float = 0.0,
+        fields: Collection[str] = CHANNEL_FIELDS,
+        deadband: Optional[Deadband] = None,
+        events: Optional[Collection[ChannelEvent]] = None,
+        count: int = 0,
+    ) -> AsyncIterator[Dict[str, Channel]]:
+        updates = ChannelUpdates(min_interval)
+        mask = event_mask(events)
+        # Remove duplicates, preserving order
+        pvs = list(dict.fromkeys(pvs))
+
+        # Generate unique key for this subscription, shared across all its pvs
+        uid = str(uuid.uuid4())
+
+        # Subscribe in the background so that pvs which connect quickly are sent
+        # without waiting for the slow ones
+        subscribe_task = asyncio.gather(
+            *[
+                self.subscription_manager.subscribe(
+                    pv,
+                    updates_callback(updates, pv, deadband),
+                    uid,
+                    fields,
+                    mask,
+                    count,
+                )
+                for pv in pvs
+            ]
+        )
 
-            value.put_nowait(channel)
+        def _on_completion(t: asyncio.Future):
+            error = None if t.cancelled() else t.exception()
+            if error:
+                updates.fail(error)
 
-        await self.subscription_manager.subscribe(pv, __callback, uid)
+        subscribe_task.add_done_callback(_on_completion)
 
         try:
             while True:
-                yield await value.get()
+                yield await updates.get()
 
         finally:
-            self.subscription_manager.unsubscribe(pv, uid)
+            subscribe_task.cancel()
+            for pv in pvs:
+                self.subscription_manager.unsubscribe(pv, uid, mask, count)
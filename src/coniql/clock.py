@@ -0,0 +1,104 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, List, Optional, Set, Tuple
+
+
+class SimClock:
+    """The time that simulated channels run by. Normally this is real time, but
+    it can be switched to a virtual time that jumps straight to the next time
+    anyone is sleeping until, so sims run as fast as the server can process
+    their updates, in the same order every time. Time does not move on while
+    anyone holds it, which buffers of updates do until they are drained"""
+
+    def __init__(self) -> None:
+        # None when following real time
+        self.virtual_time: Optional[float] = None
+        # Heap of (when, order, future) for each sleeper in virtual time
+        self.sleepers: List[Tuple[float, int, asyncio.Future]] = []
+        self.order = itertools.count()
+        self.driver: Optional[asyncio.Task] = None
+        # Everyone with updates still to process
+        self.holders: Set[Any] = set()
+        # Done when the last holder releases the clock
+        self.released: Optional[asyncio.Future] = None
+
+    @property
+    def virtual(self) -> bool:
+        return self.virtual_time is not None
+
+    def time(self) -> float:
+        """Seconds since the epoch, as time.time()"""
+        if self.virtual_time is None:
+            return time.time()
+        return self.virtual_time
+
+    def set_virtual(self, start: Optional[float] = None):
+        """Switch to virtual time, starting at start or the current time"""
+        self.virtual_time = self.time() if start is None else start
+
+    def set_real(self):
+        """Switch back to real time, waking anyone sleeping in virtual time to
+        sleep again in real time"""
+        self.virtual_time = None
+        for _, _, future in self.sleepers:
+            if not future.done():
+                future.set_result(None)
+        self.sleepers.clear()
+        self.holders.clear()
+        self.release(None)
+
+    def hold(self, holder: Any):
+        """Stop virtual time moving on until holder releases it"""
+        if self.virtual_time is not None:
+            self.holders.add(holder)
+
+    def release(self, holder: Any):
+        """Let virtual time move on once no-one else holds it"""
+        self.holders.discard(holder)
+        if not self.holders and self.released and not self.released.done():
+            self.released.set_result(None)
+
+    async def sleep_until(self, when: float):
+        """Sleep until the clock reads when. In virtual time this returns as soon
+        as everyone due to wake before then has had their turn"""
+        while self.virtual_time is None:
+            delay = when - time.time()
+            # Always yield, so sims ticking every 0 seconds let others run
+            await asyncio.sleep(max(delay, 0))
+            if delay <= 0:
+                return
+        if when <= self.virtual_time:
+            # Still let others run, as a real sleep would
+            await asyncio.sleep(0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.sleepers, (when, next(self.order), future))
+        if self.driver is None or self.driver.done():
+            self.driver = asyncio.create_task(self.advance())
+        await future
+        if self.virtual_time is None:
+            # Switched to real time while we slept
+            await self.sleep_until(when)
+
+    async def advance(self):
+        """Wake each sleeper in turn, moving virtual time to when it is due, once
+        everyone holding the clock has caught up"""
+        while self.sleepers and self.virtual_time is not None:
+            if self.holders:
+                self.released = asyncio.get_running_loop().create_future()
+                await self.released
+                continue
+            when, _, future = heapq.heappop(self.sleepers)
+            if future.done():
+                # Cancelled
+                continue
+            self.virtual_time = max(self.virtual_time, when)
+            future.set_result(None)
+            # Let it, and whoever it wakes, run before the next is due
+            await asyncio.sleep(0)
+
+
+# The clock for all sims
+sim_clock = SimClock()
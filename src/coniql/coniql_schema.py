@@ -53,6 +53,22 @@ class Widget(str, Enum):
     PLOTX = "PLOTX"
     # Y-axis for a line on a graph. Only valid within a Group with widget Plot
     PLOTY = "PLOTY"
+    # Read-only 2D image display
+    IMAGE = "IMAGE"
+
+
+@strawberry.enum
+class ChannelEvent(str, Enum):
+    """
+    Kind of change to a Channel that a subscription can ask to be updated on
+    """
+
+    # Value changed by more than the monitor deadband
+    VALUE = "VALUE"
+    # Value changed by more than the archive deadband
+    ARCHIVE = "ARCHIVE"
+    # Alarm status or severity changed
+    ALARM = "ALARM"
 
 
 class Layout(str, Enum):
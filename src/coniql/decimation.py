@@ -0,0 +1,84 @@
+from enum import Enum
+
+import numpy as np
+import strawberry
+
+
+@strawberry.enum
+class Decimation(Enum):
+    """
+    How to reduce an array to fewer points for display
+    """
+
+    # Every nth element
+    STRIDE = "STRIDE"
+    # The minimum then maximum of each bucket of elements, so peaks are kept
+    MINMAX = "MINMAX"
+    # Largest-Triangle-Three-Buckets, the element of each bucket that keeps
+    # the shape of the plot most faithfully
+    LTTB = "LTTB"
+
+
+def bucket_edges(start: int, stop: int, buckets: int) -> np.ndarray:
+    """The indexes between start and stop that split it into evenly sized
+    buckets, including stop"""
+    return np.linspace(start, stop, buckets + 1).astype(np.intp)
+
+
+def stride(value: np.ndarray, points: int) -> np.ndarray:
+    step = -(-len(value) // points)
+    return value[::step]
+
+
+def minmax(value: np.ndarray, points: int) -> np.ndarray:
+    if points < 2:
+        return stride(value, points)
+    buckets = points // 2
+    starts = bucket_edges(0, len(value), buckets)[:-1]
+    decimated = np.empty(buckets * 2, dtype=value.dtype)
+    decimated[0::2] = np.minimum.reduceat(value, starts)
+    decimated[1::2] = np.maximum.reduceat(value, starts)
+    return decimated
+
+
+def lttb(value: np.ndarray, points: int) -> np.ndarray:
+    if points < 3:
+        return stride(value, points)
+    y = value.astype(np.float64)
+    # The first and last points are always kept, the rest are bucketed
+    edges = bucket_edges(1, len(value) - 1, points - 2)
+    starts = edges[:-1]
+    sizes = np.diff(edges)
+    # The average point of each bucket, followed by the last point
+    avg_x = np.append(starts + (sizes - 1) / 2, len(value) - 1)
+    avg_y = np.append(np.add.reduceat(y[: edges[-1]], starts) / sizes, y[-1])
+    indexes = np.empty(points, dtype=np.intp)
+    indexes[0], indexes[-1] = 0, len(value) - 1
+    a = 0
+    # Each choice depends on the last, so only each bucket can be vectorized
+    for i, (start, stop) in enumerate(zip(edges[:-1], edges[1:])):
+        x = np.arange(start, stop)
+        # Twice the area of the triangle between the point chosen from the last
+        # bucket, each point in this one, and the average of the next
+        areas = np.abs(
+            (a - avg_x[i + 1]) * (y[start:stop] - y[a])
+            - (a - x) * (avg_y[i + 1] - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        indexes[i + 1] = a
+    return value[indexes]
+
+
+DECIMATORS = {
+    Decimation.STRIDE: stride,
+    Decimation.MINMAX: minmax,
+    Decimation.LTTB: lttb,
+}
+
+
+def decimate(value: np.ndarray, points: int, decimation: Decimation) -> np.ndarray:
+    """Reduce value to at most points elements, returning it unchanged if it
+    already has no more than that"""
+    if points <= 0 or len(value) <= points:
+        return value
+    return DECIMATORS[decimation](value, points)
@@ -0,0 +1,74 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+from coniql.plugin import MergedChannel
+from coniql.types import ArrayDelta, Channel, ChannelValue
+
+# How many updates to send between complete arrays by default
+DELTA_KEYFRAME_INTERVAL = 100
+
+
+def changed_range(old: np.ndarray, new: np.ndarray) -> Tuple[int, int]:
+    """The start and stop indexes of the elements of new that differ from old,
+    which must have the same shape and dtype, or (0, 0) if none of them do.
+    Numbers are compared by their bytes, so NaNs in the same place are unchanged"""
+    if new.dtype.kind in "biuf" and new.dtype.itemsize in (1, 2, 4, 8):
+        uint = np.dtype(f"u{new.dtype.itemsize}")
+        changed = old.view(uint) != new.view(uint)
+    else:
+        changed = old != new
+    if not changed.any():
+        return 0, 0
+    # argmax finds the first True, so search from both ends
+    return int(np.argmax(changed)), len(changed) - int(np.argmax(changed[::-1]))
+
+
+class DeltaEncoder:
+    """Replaces the array values of successive Channel updates with the range of
+    elements that changed since the last array it encoded. Every
+    keyframe_interval updates, or whenever the shape or type of the array
+    changes, the complete array is sent instead"""
+
+    def __init__(self, keyframe_interval: int = DELTA_KEYFRAME_INTERVAL) -> None:
+        assert (
+            keyframe_interval > 0
+        ), f"keyframeInterval must be positive, not {keyframe_interval}"
+        self.keyframe_interval = keyframe_interval
+        # The last array encoded, which the next delta is against
+        self.last: Optional[np.ndarray] = None
+        # Number of deltas since the last complete array
+        self.deltas = 0
+
+    def encode_value(self, value: ChannelValue) -> ChannelValue:
+        array = value.value
+        last, self.last = self.last, array
+        if not isinstance(array, np.ndarray) or array.ndim != 1:
+            # Only 1D arrays are delta encoded
+            self.last = None
+            return value
+        if (
+            last is None
+            or last.shape != array.shape
+            or last.dtype != array.dtype
+            or self.deltas + 1 >= self.keyframe_interval
+        ):
+            self.deltas = 0
+            return value
+        self.deltas += 1
+        start, stop = changed_range(last, array)
+        return ChannelValue(
+            array[start:stop], value.formatter, ArrayDelta(start, len(array))
+        )
+
+    def encode(self, channel: Channel) -> Channel:
+        value = channel.get_value()
+        if value is None:
+            return channel
+        return MergedChannel(
+            id=channel.get_id(),
+            value=self.encode_value(value),
+            time=channel.get_time(),
+            status=channel.get_status(),
+            display=channel.get_display(),
+        )
@@ -9,6 +9,7 @@ from aioprometheus import (
     REGISTRY,
     Counter,
     Gauge,
+    Histogram,
     Summary,
     count_exceptions,
     inprogress,
@@ -38,6 +39,50 @@ DROPPED_UPDATES = Gauge(
     "coniql_dropped_updates", "Number of updates dropped in subscriptions"
 )
 ACTIVE_CHANNELS = Gauge("coniql_active_channels", "Number of active channels in aioca")
+MONITOR_LINGER_HITS = Counter(
+    "coniql_monitor_linger_hits",
+    "Number of subscriptions that reused camonitors kept open with no subscribers",
+)
+MONITOR_LINGER_EXPIRIES = Counter(
+    "coniql_monitor_linger_expiries",
+    "Number of times camonitors were closed after having no subscribers",
+)
+PV_REGISTRY_SIZE = Gauge(
+    "coniql_pv_registry_size", "Number of PVs with open CA monitors"
+)
+PV_REGISTRY_BYTES = Gauge(
+    "coniql_pv_registry_bytes",
+    "Approximate bytes of PV values held by the CA subscription manager",
+)
+FIRST_UPDATE_TIME = Histogram(
+    "coniql_first_update_seconds",
+    "Time from subscribing to a CA PV to sending its first complete update",
+)
+ARRAY_CACHE_HITS = Counter(
+    "coniql_array_cache_hits",
+    "Number of array values formatted from the result of an earlier request",
+)
+ARRAY_CACHE_BYTES_SAVED = Counter(
+    "coniql_array_cache_bytes_saved",
+    "Bytes of array formatting reused from the result of an earlier request",
+)
+OFFLOAD_QUEUE_DEPTH = Gauge(
+    "coniql_offload_queue_depth",
+    "Number of array formatting calls waiting for or running in the worker pool",
+)
+OFFLOAD_TIME = Histogram(
+    "coniql_offload_seconds",
+    "Time from sending array formatting to the worker pool to getting the result",
+)
+
+SIM_TICK_JITTER = Histogram(
+    "coniql_sim_tick_jitter_seconds",
+    "How late each tick of simulated channels started after it was due",
+)
+SIM_TICK_OVERRUNS = Counter(
+    "coniql_sim_tick_overruns",
+    "Number of ticks of simulated channels that ran past the next one",
+)
 
 
 class MetricsExtension(SchemaExtension):
@@ -0,0 +1,46 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from coniql.metrics import OFFLOAD_QUEUE_DEPTH, OFFLOAD_TIME
+
+T = TypeVar("T")
+
+# Arrays of at least this many bytes are formatted in a worker thread
+OFFLOAD_THRESHOLD_BYTES = 1_000_000
+
+
+class ArrayOffloader:
+    """Runs the formatting of arrays of at least `threshold` bytes in a pool of
+    worker threads, so the event loop can get on with other requests while
+    they are encoded. A threshold of 0 formats everything in the event loop"""
+
+    def __init__(
+        self,
+        threshold: int = OFFLOAD_THRESHOLD_BYTES,
+        max_workers: Optional[int] = None,
+    ) -> None:
+        self.threshold = threshold
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="coniql-offload"
+        )
+        # Number of calls submitted to the pool that have not finished
+        self.queued = 0
+
+    def should_offload(self, nbytes: int) -> bool:
+        return 0 < self.threshold <= nbytes
+
+    async def run(self, compute: Callable[[], T]) -> T:
+        """Run compute in the pool, returning its result"""
+        self.queued += 1
+        OFFLOAD_QUEUE_DEPTH.set({}, self.queued)
+        start = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, compute
+            )
+        finally:
+            self.queued -= 1
+            OFFLOAD_QUEUE_DEPTH.set({}, self.queued)
+            OFFLOAD_TIME.observe({}, time.monotonic() - start)
@@ -1,17 +1,51 @@
-from typing import AsyncIterator, Dict, List, Sequence, Tuple, Union
+import asyncio
+import numbers
+import time
+from dataclasses import dataclass
+from typing import (
+    AsyncIterator,
+    Collection,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 
-from coniql.types import Channel
+from coniql.coniql_schema import ChannelEvent
+from coniql.types import (
+    Channel,
+    ChannelDisplay,
+    ChannelStatus,
+    ChannelTime,
+    ChannelValue,
+    Range,
+)
 
 PutValue = Union[bool, int, float, str, List[str], np.ndarray]
 
+# The top level fields of a Channel that can be asked for, besides its id
+CHANNEL_FIELDS = ("value", "time", "status", "display")
+
 
 class Plugin:
     transport: str
 
-    async def get_channel(self, pv: str, timeout: float) -> Channel:
-        """Get the current structure of a Channel"""
+    async def get_channel(
+        self,
+        pv: str,
+        timeout: float,
+        fresh: bool = False,
+        fields: Collection[str] = CHANNEL_FIELDS,
+        count: int = 0,
+    ) -> Channel:
+        """Get the current structure of a Channel. Plugins may answer from values
+        they already hold for the Channel, unless fresh is True. Only the given
+        top level fields need be filled in, and if count is given only that many
+        elements from the start of an array value"""
         raise NotImplementedError(self)
 
     async def put_channels(
@@ -20,12 +54,193 @@ class Plugin:
         """Put a value to a channel, returning the structure after put"""
         raise NotImplementedError(self)
 
-    async def subscribe_channel(self, pv: str) -> AsyncIterator[Channel]:
+    async def subscribe_channel(
+        self,
+        pv: str,
+        min_interval: float = 0.0,
+        fields: Collection[str] = CHANNEL_FIELDS,
+        deadband: Optional["Deadband"] = None,
+        events: Optional[Collection[ChannelEvent]] = None,
+        count: int = 0,
+    ) -> AsyncIterator[Channel]:
         """Subscribe to the structure of the Channel, yielding structures
-        where only changing top level fields are filled in"""
+        where only changing top level fields are filled in. Structures are
+        yielded no more often than min_interval seconds, with any changes in
+        between merged together. Only changes to the given top level fields
+        need be yielded. If deadband is given, updates that only move the value
+        within it are dropped. If events are given, plugins that can tell the
+        kinds of change apart only yield those, otherwise they use their own
+        default. As for get_channel, count limits the array elements needed"""
         raise NotImplementedError(self)
         yield
 
+    async def subscribe_channels(
+        self,
+        pvs: List[str],
+        min_interval: float = 0.0,
+        fields: Collection[str] = CHANNEL_FIELDS,
+        deadband: Optional["Deadband"] = None,
+        events: Optional[Collection[ChannelEvent]] = None,
+        count: int = 0,
+    ) -> AsyncIterator[Dict[str, Channel]]:
+        """Subscribe to a number of Channels at once, yielding {pv: structure}
+        for every pv that has changed since the last yield. The first time each
+        pv appears its structure is complete, afterwards only changing top level
+        fields are filled in"""
+        updates = ChannelUpdates(min_interval)
+
+        async def _pump(pv: str):
+            try:
+                async for channel in self.subscribe_channel(
+                    pv, fields=fields, deadband=deadband, events=events, count=count
+                ):
+                    updates.put(pv, channel)
+            except Exception as e:
+                updates.fail(e)
+
+        tasks = [asyncio.create_task(_pump(pv)) for pv in pvs]
+        try:
+            while True:
+                yield await updates.get()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+@dataclass
+class MergedChannel(Channel):
+    id: Optional[str]
+    value: Optional[ChannelValue]
+    time: Optional[ChannelTime]
+    status: Optional[ChannelStatus]
+    display: Optional[ChannelDisplay]
+
+    def get_id(self) -> Optional[str]:
+        return self.id
+
+    def get_time(self) -> Optional[ChannelTime]:
+        return self.time
+
+    def get_status(self) -> Optional[ChannelStatus]:
+        return self.status
+
+    def get_value(self) -> Optional[ChannelValue]:
+        return self.value
+
+    def get_display(self) -> Optional[ChannelDisplay]:
+        return self.display
+
+
+def merge_channels(old: Channel, new: Channel) -> Channel:
+    """Merge two consecutive Channel structures where only changing top level
+    fields are filled in, giving a single structure with the latest of each"""
+
+    def latest(field: str):
+        new_value = getattr(new, f"get_{field}")()
+        if new_value is None:
+            return getattr(old, f"get_{field}")()
+        return new_value
+
+    return MergedChannel(
+        id=latest("id"),
+        value=latest("value"),
+        time=latest("time"),
+        status=latest("status"),
+        display=latest("display"),
+    )
+
+
+@dataclass(frozen=True)
+class Deadband:
+    """How far the value of a Channel must move before an update is sent"""
+
+    size: float
+    # If True then size is a percentage of the displayRange
+    relative: bool = False
+
+
+class DeadbandFilter:
+    """Drops Channel updates whose value is within the deadband of the last value
+    let through. Updates that change anything other than the value and time,
+    like the alarm or connection status, are always let through"""
+
+    def __init__(self, deadband: Deadband) -> None:
+        self.deadband = deadband
+        self.display_range: Optional[Range] = None
+        self.last: Optional[float] = None
+
+    def size(self) -> Optional[float]:
+        if not self.deadband.relative:
+            return self.deadband.size
+        elif self.display_range is None:
+            return None
+        span = abs(self.display_range.max - self.display_range.min)
+        return span * self.deadband.size / 100
+
+    def passes(self, channel: Channel) -> bool:
+        display = channel.get_display()
+        if display is not None:
+            self.display_range = display.displayRange
+        value = channel.get_value()
+        number = value.value if value is not None else None
+        # Arrays, strings and the like always pass
+        if not isinstance(number, numbers.Real) or isinstance(number, bool):
+            return True
+        size = self.size()
+        if (
+            self.last is not None
+            and size is not None
+            and display is None
+            and channel.get_status() is None
+            # Written this way round so NaNs pass
+            and abs(float(number) - self.last) <= size
+        ):
+            return False
+        self.last = float(number)
+        return True
+
+
+class ChannelUpdates:
+    """Holds the latest Channel update for each pv until the consumer is ready
+    for it, merging it with any update that has not yet been consumed.
+
+    If min_interval is given then updates are released no more often than that,
+    with everything that arrives in between merged into a single update"""
+
+    def __init__(self, min_interval: float = 0.0) -> None:
+        # {pv: channel}
+        self.pending: Dict[str, Channel] = {}
+        self.ready = asyncio.Event()
+        self.error: Optional[BaseException] = None
+        self.min_interval = min_interval
+        self.last_get = -min_interval
+
+    def put(self, pv: str, channel: Channel):
+        old = self.pending.get(pv)
+        if old is None:
+            self.pending[pv] = channel
+        else:
+            self.pending[pv] = merge_channels(old, channel)
+        self.ready.set()
+
+    def fail(self, error: BaseException):
+        """Make the consumer raise the given error on its next get"""
+        self.error = error
+        self.ready.set()
+
+    async def get(self) -> Dict[str, Channel]:
+        """Wait until there is at least one update, then return all of them"""
+        await self.ready.wait()
+        if self.min_interval:
+            # Let further updates coalesce until the interval has passed
+            await asyncio.sleep(self.last_get + self.min_interval - time.monotonic())
+            self.last_get = time.monotonic()
+        if self.error:
+            raise self.error
+        self.ready.clear()
+        pending, self.pending = self.pending, {}
+        return pending
+
 
 class PluginStore:
     def __init__(self) -> None:
@@ -1,13 +1,37 @@
 import asyncio
+import logging
 import math
 import time
+from collections import deque
 from dataclasses import dataclass, replace
-from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence, Set, Type
+from typing import (
+    Any,
+    AsyncGenerator,
+    Collection,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    cast,
+)
 
 import numpy as np
 
-from coniql.coniql_schema import DisplayForm, Widget
-from coniql.plugin import Plugin, PutValue
+from coniql.clock import sim_clock
+from coniql.coniql_schema import ChannelEvent, DisplayForm, Widget
+from coniql.metrics import DROPPED_UPDATES, SIM_TICK_JITTER, SIM_TICK_OVERRUNS
+from coniql.plugin import (
+    CHANNEL_FIELDS,
+    Deadband,
+    DeadbandFilter,
+    Plugin,
+    PutValue,
+    merge_channels,
+)
 from coniql.types import (
     Channel,
     ChannelDisplay,
@@ -19,9 +43,14 @@ from coniql.types import (
     Range,
 )
 
+coniql_logger = logging.getLogger(__name__)
+
 # How long to keep Sim alive after the last listener has gone
 SIM_DESTROY_TIMEOUT = 10
 
+# How many updates each listener can fall behind before they are merged
+SIM_LISTENER_BUFFER = 10
+
 # Map of pv func to its Sim class
 CHANNEL_CLASSES: Dict[str, Type["Sim"]] = {}
 
@@ -82,6 +111,31 @@ class Sim:
     def compute_changes(self) -> Channel:
         raise NotImplementedError(self)
 
+    def apply_computed(self, value, status: ChannelStatus, now: ChannelTime) -> Channel:
+        """A faster apply_changes for compute_batch, where only the value and
+        status can change and the time is shared by the whole batch"""
+        changes: Dict[str, Any] = {"time": now}
+        channel = self.channel
+        assert channel.value is not None, channel
+        if isinstance(value, np.ndarray) or value != channel.value.value:
+            changes["value"] = ChannelValue(value, channel.value.formatter)
+        if status != channel.status:
+            changes["status"] = status
+        self.channel = SimChannel(
+            id=channel.id,
+            value=changes.get("value", channel.value),
+            display=channel.display,
+            time=now,
+            status=changes.get("status", channel.status),
+        )
+        return SimChannel(**changes)
+
+    @classmethod
+    def compute_batch(cls, sims: Sequence["Sim"]) -> List[Channel]:
+        """Compute the changes of a number of sims of this class that tick
+        together. Subclasses can override this to compute them all at once"""
+        return [sim.compute_changes() for sim in sims]
+
 
 def make_display(
     min_value: float,
@@ -157,6 +211,17 @@ class SineSim(Sim):
             widget=Widget.TEXTUPDATE,
         )
         self.channel.display = display
+        assert display.alarmRange and display.warningRange
+        # Everything but x that compute_batch needs, in the order it wants them
+        self.params = (
+            self.min,
+            self.range,
+            self.step,
+            display.alarmRange.min,
+            display.alarmRange.max,
+            display.warningRange.min,
+            display.warningRange.max,
+        )
         self.channel.value = ChannelValue(
             0,
             ChannelFormatter.for_number(display.precision, display.units),
@@ -176,6 +241,33 @@ class SineSim(Sim):
             status = ChannelStatus.valid()
         return self.apply_changes(value, status=status)
 
+    @classmethod
+    def compute_batch(cls, sims: Sequence[Sim]) -> List[Channel]:
+        sine_sims = cast(Sequence[SineSim], sims)
+        # Struct of arrays, one row per sim
+        params = np.array([sim.params for sim in sine_sims]).T
+        min_value, value_range, step, alarm_min, alarm_max, warn_min, warn_max = params
+        x = np.array([sim.x for sim in sine_sims]) + step
+        values = min_value + (np.sin(x) + 1.0) / 2.0 * value_range
+        # 0 = valid, 1 = warning, 2 = alarm, written so NaNs are alarms
+        severities = np.where((alarm_min <= values) & (values <= alarm_max), 0, 2)
+        severities[
+            (severities == 0) & ~((warn_min <= values) & (values <= warn_max))
+        ] = 1
+        statuses = [
+            ChannelStatus.valid(),
+            ChannelStatus.warning("Outside warning range"),
+            ChannelStatus.alarm("Outside alarm range"),
+        ]
+        now = ChannelTime.now()
+        changes = []
+        for sim, xi, value, severity in zip(
+            sine_sims, x.tolist(), values.tolist(), severities.tolist()
+        ):
+            sim.x = xi
+            changes.append(sim.apply_computed(value, statuses[severity], now))
+        return changes
+
 
 @register_channel("sinewave")
 class SineWaveSim(Sim):
@@ -205,7 +297,7 @@ class SineWaveSim(Sim):
         self.period = max(period_seconds, 0.001)
         self.size = int(size)
         self.wavelength = sample_wavelength
-        self.start = time.time()
+        self.start = sim_clock.time()
         display = make_display(
             min_value,
             max_value,
@@ -222,7 +314,7 @@ class SineWaveSim(Sim):
         )
 
     def compute_changes(self) -> Channel:
-        t = time.time() - self.start
+        t = sim_clock.time() - self.start
         x0 = t / self.period
         x = 2 * math.pi * (x0 + np.arange(self.size) / self.wavelength)
         value = self.min + (np.sin(x) + 1.0) / 2.0 * self.range
@@ -282,37 +374,351 @@ class RampWaveSim(Sim):
         value = self.ramps[self.i : self.i + self.size]
         return self.apply_changes(value)
 
+    @classmethod
+    def compute_batch(cls, sims: Sequence[Sim]) -> List[Channel]:
+        ramp_sims = cast(Sequence[RampWaveSim], sims)
+        i = np.array([sim.i + 1 for sim in ramp_sims])
+        i[i >= np.array([sim.ramp_length for sim in ramp_sims])] = 0
+        now = ChannelTime.now()
+        changes = []
+        for sim, start in zip(ramp_sims, i.tolist()):
+            sim.i = start
+            value = sim.ramps[start : start + sim.size]
+            assert sim.channel.status is not None
+            changes.append(sim.apply_computed(value, sim.channel.status, now))
+        return changes
+
+
+@register_channel("counter")
+class CounterSim(Sim):
+    """Create a simulated integer counter, which can update at kHz rates
+
+    Args:
+        update_seconds: The time between each count
+        size: If more than 1, a waveform of this many consecutive counts
+        step: How much the counter goes up by each count
+        max_value: The counter wraps back to 0 when it reaches this value
+    """
+
+    def __init__(
+        self,
+        update_seconds: float = 0.001,
+        size: float = 1.0,
+        step: float = 1.0,
+        max_value: float = 2**31,
+    ):
+        super().__init__(update_seconds)
+        self.size = int(size)
+        self.step = int(step)
+        self.max = int(max_value)
+        self.count = 0
+        display = make_display(
+            0,
+            max_value,
+            warning_percent=100.0,
+            alarm_percent=100.0,
+            description="A counter",
+            role=ChannelRole.RO,
+            widget=Widget.TEXTUPDATE if self.size == 1 else Widget.PLOTY,
+        )
+        display.precision = 0
+        self.channel.display = display
+        if self.size == 1:
+            formatter = ChannelFormatter.for_number(display.precision, display.units)
+        else:
+            formatter = ChannelFormatter.for_ndarray(display.precision, display.units)
+        self.channel.value = ChannelValue(self.counts(), formatter)
+
+    def counts(self) -> Any:
+        if self.size == 1:
+            return self.count
+        counts = self.count + self.step * np.arange(self.size, dtype=np.int64)
+        return counts % self.max
+
+    def compute_changes(self) -> Channel:
+        self.count = (self.count + self.step * self.size) % self.max
+        return self.apply_changes(self.counts())
+
+
+@register_channel("noise")
+class NoiseSim(Sim):
+    """Create a simulated waveform of uniformly distributed random noise
+
+    Args:
+        size: The size of the output waveform
+        update_seconds: The time between new waveforms
+        dtype: The numpy dtype of the waveform, like float64 or uint16
+        min_value: The minimum output value (inclusive)
+        max_value: The maximum output value (exclusive)
+    """
+
+    def __init__(
+        self,
+        size: float = 1000.0,
+        update_seconds: float = 1.0,
+        dtype: str = "float64",
+        min_value: float = -5.0,
+        max_value: float = 5.0,
+    ):
+        super().__init__(update_seconds)
+        self.shape: Tuple[int, ...] = (int(size),)
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind in "iu":
+            # Keep within what the dtype can hold, max_value being exclusive
+            info = np.iinfo(self.dtype)
+            min_value = max(min_value, info.min)
+            max_value = min(max_value, info.max + 1)
+        self.min = min_value
+        self.max = max_value
+        self.rng = np.random.default_rng()
+        display = make_display(
+            min_value,
+            max_value,
+            warning_percent=100.0,
+            alarm_percent=100.0,
+            description="A random noise generator",
+            role=ChannelRole.RO,
+            widget=Widget.PLOTY,
+        )
+        self.channel.display = display
+        if self.dtype.kind != "f":
+            display.precision = 0
+        self.channel.value = ChannelValue(
+            np.zeros(self.shape, dtype=self.dtype),
+            ChannelFormatter.for_ndarray(display.precision, display.units),
+        )
+
+    def noise(self) -> np.ndarray:
+        if self.dtype.kind == "f":
+            return self.rng.uniform(self.min, self.max, self.shape).astype(self.dtype)
+        return self.rng.integers(
+            int(self.min), int(self.max), self.shape, dtype=self.dtype
+        )
+
+    def compute_changes(self) -> Channel:
+        return self.apply_changes(self.noise())
+
+
+@register_channel("image")
+class ImageSim(NoiseSim):
+    """Create simulated 2D image frames of noise, with a bright spot moving
+    across them
+
+    Args:
+        width: The number of columns in each frame
+        height: The number of rows in each frame
+        update_seconds: The time between new frames
+        dtype: The numpy dtype of the frames, like uint8 or uint16
+        max_value: The maximum pixel value (exclusive)
+    """
+
+    def __init__(
+        self,
+        width: float = 640.0,
+        height: float = 480.0,
+        update_seconds: float = 0.1,
+        dtype: str = "uint16",
+        max_value: float = 4096.0,
+    ):
+        super().__init__(width * height, update_seconds, dtype, 0, max_value)
+        self.shape = (int(height), int(width))
+        assert self.channel.value and self.channel.display
+        self.channel.value.value = np.zeros(self.shape, dtype=self.dtype)
+        self.channel.display.description = "An image frame generator"
+        self.channel.display.widget = Widget.IMAGE
+        self.frame = 0
+
+    def compute_changes(self) -> Channel:
+        # Start from a dim background so the spot stands out
+        image = self.noise() // 4
+        height, width = self.shape
+        self.frame += 1
+        row = self.frame % height
+        column = self.frame * 3 % width
+        image[row : row + 8, column : column + 8] = self.max - 1
+        return self.apply_changes(image)
+
+
+def parse_parameter(param: str) -> Any:
+    """Sim parameters are numbers, apart from names like the dtype of arrays"""
+    param = param.strip()
+    try:
+        return float(param)
+    except ValueError:
+        return param
+
+
+class SimListener:
+    """The updates of a sim waiting for one of its subscribers. At most maxsize
+    are held, after which each new update is merged into the newest one held, so
+    the latest of each field is kept even though intermediate values are lost.
+    The sim clock is held while there are updates, so virtual time waits for
+    the subscriber to catch up"""
+
+    def __init__(self, pv: str, maxsize: int = SIM_LISTENER_BUFFER) -> None:
+        self.pv = pv
+        self.updates: Deque[Channel] = deque()
+        self.maxsize = maxsize
+        self.ready = asyncio.Event()
+        # Number of updates merged into another because the buffer was full
+        self.dropped = 0
+        # Raised to the subscriber if the sim stops while it is listening
+        self.error: Optional[Exception] = None
+
+    def put(self, channel: Channel):
+        if len(self.updates) >= self.maxsize:
+            self.updates[-1] = merge_channels(self.updates[-1], channel)
+            self.dropped += 1
+            DROPPED_UPDATES.inc({"type": "sim", "pv": self.pv})
+        else:
+            self.updates.append(channel)
+        sim_clock.hold(self)
+        self.ready.set()
+
+    def empty(self) -> bool:
+        return not self.updates
+
+    def get_nowait(self) -> Channel:
+        channel = self.updates.popleft()
+        if not self.updates:
+            sim_clock.release(self)
+        return channel
+
+    async def get(self) -> Channel:
+        while not self.updates:
+            if self.error:
+                raise self.error
+            self.ready.clear()
+            await self.ready.wait()
+        return self.get_nowait()
+
+    def close(self, error: Optional[Exception] = None):
+        """Drop any updates left, as no-one will take them or the sim has
+        stopped. If error is given it is raised to the subscriber"""
+        self.updates.clear()
+        sim_clock.release(self)
+        self.error = error
+        self.ready.set()
+
 
 class SimPlugin(Plugin):
     def __init__(self) -> None:
         # {pv: Sim}
         self.sims: Dict[str, Sim] = {}
-        # {pv: {queue_for_each_listener}}
-        self.listeners: Dict[str, Set[asyncio.Queue[Channel]]] = {}
+        # {pv: {listener}}
+        self.listeners: Dict[str, Set[SimListener]] = {}
+        # {pv: time of the last tick it had listeners}
+        self.last_had_listeners: Dict[str, float] = {}
+        # {update_seconds: {pv}} of the sims ticked together
+        self.groups: Dict[float, Set[str]] = {}
+        # {update_seconds: task ticking that group}
+        self.group_tasks: Dict[float, asyncio.Task[Any]] = {}
         # Set of asyncio tasks running
         self.task_references: Set[asyncio.Task[Any]] = set()
 
-    async def _start_computing(self, pv: str):
-        sim = self.sims[pv]
-        next_compute = time.time()
-        last_had_listeners = next_compute
-        while next_compute - last_had_listeners < SIM_DESTROY_TIMEOUT:
-            next_compute += sim.update_seconds
-            await asyncio.sleep(next_compute - time.time())
-            changes = sim.compute_changes()
-            for q in self.listeners[pv]:
-                last_had_listeners = next_compute
-                await q.put(changes)
-        # no-one listening, remove sim
+    def _schedule(self, pv: str):
+        """Add the sim for pv to the group that ticks at its update_seconds,
+        starting the task for that group if it is the first"""
+        update_seconds = self.sims[pv].update_seconds
+        self.last_had_listeners[pv] = sim_clock.time()
+        group_task = self.group_tasks.get(update_seconds)
+        if group_task and not group_task.done():
+            self.groups[update_seconds].add(pv)
+            return
+        elif group_task:
+            # Finished, but its done callback has not run yet
+            self._remove_group(update_seconds)
+        self.groups[update_seconds] = {pv}
+        task = asyncio.create_task(self._start_computing(update_seconds))
+        self.group_tasks[update_seconds] = task
+        self.task_references.add(task)
+
+        def _on_completion(t):
+            self.task_references.remove(t)
+            if self.group_tasks.get(update_seconds) is t:
+                self._remove_group(update_seconds)
+
+        task.add_done_callback(_on_completion)
+
+    def _destroy(self, pv: str, error: Optional[Exception] = None):
         del self.sims[pv]
-        del self.listeners[pv]
-
-    async def get_channel(self, pv: str, timeout: float) -> Channel:
+        for listener in self.listeners.pop(pv):
+            listener.close(error)
+        del self.last_had_listeners[pv]
+
+    def _remove_group(self, update_seconds: float):
+        """Forget a group whose task has finished. If it was cancelled, remove the
+        sims that will no longer tick so they are made afresh the next time
+        they are asked for, ending their subscriptions with an error"""
+        for pv in self.groups.pop(update_seconds):
+            self._destroy(pv, RuntimeError(f"Sim {pv!r} stopped"))
+        del self.group_tasks[update_seconds]
+
+    def _send(self, pv: str, changes: Channel):
+        for listener in self.listeners[pv]:
+            listener.put(changes)
+
+    def _compute(self, pvs: Set[str], batch: List[str]):
+        """Compute the next changes of a batch of sims of the same class and send
+        them to their listeners. If that fails compute them one at a time, so
+        only the failing sims are removed from pvs"""
+        try:
+            sims = [self.sims[pv] for pv in batch]
+            changes = type(sims[0]).compute_batch(sims)
+        except Exception:
+            for pv in batch:
+                try:
+                    self._send(pv, self.sims[pv].compute_changes())
+                except Exception as e:
+                    coniql_logger.exception("Sim %r failed, removing it", pv)
+                    pvs.remove(pv)
+                    self._destroy(pv, RuntimeError(f"Sim {pv!r} failed: {e}"))
+        else:
+            for pv, channel in zip(batch, changes):
+                self._send(pv, channel)
+
+    async def _start_computing(self, update_seconds: float):
+        """Compute all the sims with the same update_seconds in a single pass
+        each tick, until none of them are left"""
+        pvs = self.groups[update_seconds]
+        next_tick = sim_clock.time()
+        while pvs:
+            next_tick += update_seconds
+            await sim_clock.sleep_until(next_tick)
+            start = sim_clock.time()
+            SIM_TICK_JITTER.observe({}, max(start - next_tick, 0.0))
+            # {sim class: [pv]} so each class can compute its sims together
+            batches: Dict[Type[Sim], List[str]] = {}
+            for pv in list(pvs):
+                if self.listeners[pv]:
+                    self.last_had_listeners[pv] = next_tick
+                elif next_tick - self.last_had_listeners[pv] >= SIM_DESTROY_TIMEOUT:
+                    # no-one listening, remove sim
+                    pvs.remove(pv)
+                    self._destroy(pv)
+                    continue
+                batches.setdefault(type(self.sims[pv]), []).append(pv)
+            for batch in batches.values():
+                self._compute(pvs, batch)
+            overrun = sim_clock.time() - next_tick
+            if update_seconds > 0 and overrun >= update_seconds:
+                # Skip the ticks we have missed rather than running them late
+                SIM_TICK_OVERRUNS.inc({})
+                next_tick += overrun // update_seconds * update_seconds
+
+    async def get_channel(
+        self,
+        pv: str,
+        timeout: float,
+        fresh: bool = False,
+        fields: Collection[str] = CHANNEL_FIELDS,
+        count: int = 0,
+    ) -> Channel:
         if pv not in self.sims:
             if "(" in pv:
                 assert pv.endswith(")"), "Missing closing bracket in %r" % pv
                 func, param_str = pv[:-1].split("(", 1)
-                parameters = [float(param.strip()) for param in param_str.split(",")]
+                parameters = [parse_parameter(param) for param in param_str.split(",")]
             else:
                 func = pv
                 parameters = []
@@ -322,26 +728,45 @@ class SimPlugin(Plugin):
             assert display
             self.sims[pv] = inst
             self.listeners[pv] = set()
-            task = asyncio.create_task(self._start_computing(pv))
-            self.task_references.add(task)
-
-            def _on_completion(t):
-                self.task_references.remove(t)
-
-            task.add_done_callback(_on_completion)
+            self._schedule(pv)
 
         return self.sims[pv].channel
 
-    async def subscribe_channel(self, pv: str) -> AsyncGenerator[Channel, None]:
-        q: asyncio.Queue[Channel] = asyncio.Queue()
+    async def subscribe_channel(
+        self,
+        pv: str,
+        min_interval: float = 0.0,
+        fields: Collection[str] = CHANNEL_FIELDS,
+        deadband: Optional[Deadband] = None,
+        events: Optional[Collection[ChannelEvent]] = None,
+        count: int = 0,
+    ) -> AsyncGenerator[Channel, None]:
+        q = SimListener(pv)
+        deadband_filter = DeadbandFilter(deadband) if deadband else None
         try:
             channel = await self.get_channel(pv, 0)
             self.listeners[pv].add(q)
+            if deadband_filter:
+                deadband_filter.passes(channel)
+            last_yield = time.monotonic()
             yield channel
             while True:
-                yield await q.get()
+                channel = await q.get()
+                if deadband_filter and not deadband_filter.passes(channel):
+                    continue
+                if min_interval:
+                    # Merge everything that arrives until the interval has passed
+                    await asyncio.sleep(last_yield + min_interval - time.monotonic())
+                    last_yield = time.monotonic()
+                    while not q.empty():
+                        new = q.get_nowait()
+                        if not deadband_filter or deadband_filter.passes(new):
+                            channel = merge_channels(channel, new)
+                yield channel
         finally:
-            self.listeners[pv].remove(q)
+            # The sim may have already been removed if its task was cancelled
+            self.listeners.get(pv, set()).discard(q)
+            q.close()
 
     async def put_channels(
         self, pvs: List[str], values: Sequence[PutValue], timeout: float
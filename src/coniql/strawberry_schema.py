@@ -1,28 +1,119 @@
 import asyncio
 import base64
 import datetime
+import functools
 import json
-from typing import AsyncGenerator, List, Optional, Sequence, Set, Union
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Collection,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import strawberry
+from graphql.language import OperationType
+from strawberry.types import Info
+from strawberry.types.nodes import SelectedField, Selection
 
 from coniql.caplugin import CAPlugin
-from coniql.plugin import Plugin, PluginStore
+from coniql.coniql_schema import ChannelEvent
+from coniql.decimation import Decimation, decimate
+from coniql.delta import DELTA_KEYFRAME_INTERVAL, DeltaEncoder
+from coniql.metrics import ARRAY_CACHE_BYTES_SAVED, ARRAY_CACHE_HITS
+from coniql.offload import ArrayOffloader
+from coniql.plugin import (
+    CHANNEL_FIELDS,
+    ChannelUpdates,
+    Deadband,
+    Plugin,
+    PluginStore,
+)
 from coniql.simplugin import SimPlugin
+from coniql.types import DECOMPRESSORS, ArrayDelta, ArrayFrame
 from coniql.types import Base64Array as TypeBase64Array
+from coniql.types import BinaryFrame
 from coniql.types import Channel as TypeChannel
 from coniql.types import ChannelDisplay
 from coniql.types import ChannelStatus as TypeChannelStatus
 from coniql.types import ChannelTime as TypeChannelTime
 from coniql.types import ChannelValue as TypeChannelValue
-from coniql.types import TypeFloatAlias
+from coniql.types import Compression, TypeFloatAlias, array_slice
 
 store_global = PluginStore()
+array_offloader = ArrayOffloader()
 store_global.add_plugin("ssim", SimPlugin())
 store_global.add_plugin("ca", CAPlugin(), set_default=True)
 
 
+def decimated_array(
+    root: TypeChannelValue,
+    length: int,
+    offset: int,
+    max_points: int,
+    decimation: Decimation,
+) -> np.ndarray:
+    """The slice of an array value reduced to at most max_points elements, shared
+    by everyone asking for the same one"""
+    return root.memoize(
+        ("decimate", length, offset, max_points, decimation),
+        lambda: decimate(
+            array_slice(root.value, length, offset).reshape(-1), max_points, decimation
+        ),
+    )
+
+
+def formatted_nbytes(formatted: Any) -> int:
+    """The number of bytes of the array representation that will be sent"""
+    if isinstance(formatted, TypeBase64Array):
+        return len(formatted.base64)
+    elif isinstance(formatted, list):
+        return sum(len(x) for x in formatted)
+    elif isinstance(formatted, BinaryFrame):
+        return len(formatted.data)
+    return 0
+
+
+async def memoize_array(
+    root: TypeChannelValue, key: Tuple, compute: Callable[[], Any], nbytes: int
+) -> Any:
+    """Format an array value once for all the subscribers and selections that
+    ask for the same representation of it. If compute has to work through at
+    least the array_offloader's threshold of nbytes, it is run by the
+    array_offloader, with everyone asking meanwhile waiting for that result"""
+
+    def compute_with_nbytes():
+        formatted = compute()
+        return formatted, formatted_nbytes(formatted)
+
+    def start_computing():
+        if array_offloader.should_offload(nbytes):
+            return asyncio.ensure_future(array_offloader.run(compute_with_nbytes))
+        return compute_with_nbytes()
+
+    hit = key in root.cache
+    result = root.memoize(key, start_computing)
+    if isinstance(result, asyncio.Future):
+        # Shielded so one requester going away doesn't cancel it for the rest
+        result = await asyncio.shield(result)
+        # Later requests can use the result without waiting
+        root.cache[key] = result
+    formatted, formatted_bytes = result
+    if hit:
+        labels = {"field": key[0]}
+        ARRAY_CACHE_HITS.inc(labels)
+        ARRAY_CACHE_BYTES_SAVED.add(labels, formatted_bytes)
+    return formatted
+
+
 def resolve_float(root: TypeChannelValue) -> Optional[float]:
     return root.formatter.to_float(root.value)
 
@@ -34,14 +125,111 @@ def resolve_string(root: TypeChannelValue, units: bool = False) -> Optional[str]
         return root.formatter.to_string(root.value)
 
 
-def resolve_base64Array(
-    root: TypeChannelValue, length: int = 0
+async def format_array(
+    root: TypeChannelValue,
+    field: str,
+    to_array: Callable[[Any, int, int], Any],
+    length: int,
+    offset: int,
+    max_points: int,
+    decimation: Decimation,
+    options: Tuple[Hashable, ...] = (),
+) -> Any:
+    """Format an array value with to_array, decimating it if max_points is given.
+    Any options that change what to_array returns must be given so the result is
+    only shared with those asking for the same ones"""
+    if not isinstance(root.value, np.ndarray):
+        return to_array(root.value, length, offset)
+    # Only the selected elements are formatted, or decimated then formatted
+    nbytes = array_slice(root.value, length, offset).nbytes
+    if max_points > 0:
+        decimated = root.cache.get(("decimate", length, offset, max_points, decimation))
+        if decimated is not None:
+            nbytes = decimated.nbytes
+        return await memoize_array(
+            root,
+            (field, length, offset, max_points, decimation) + options,
+            lambda: to_array(
+                decimated_array(root, length, offset, max_points, decimation), 0, 0
+            ),
+            nbytes,
+        )
+    return await memoize_array(
+        root,
+        (field, length, offset) + options,
+        lambda: to_array(root.value, length, offset),
+        nbytes,
+    )
+
+
+async def resolve_base64Array(
+    root: TypeChannelValue,
+    length: int = 0,
+    offset: int = 0,
+    maxPoints: int = 0,
+    decimation: Decimation = Decimation.STRIDE,
+    compression: Compression = Compression.NONE,
 ) -> Optional[TypeBase64Array]:
-    return root.formatter.to_base64_array(root.value, length)
+    return await format_array(
+        root,
+        "base64Array",
+        functools.partial(root.formatter.to_base64_array, compression=compression),
+        length,
+        offset,
+        maxPoints,
+        decimation,
+        (compression,),
+    )
+
+
+async def resolve_stringArray(
+    root: TypeChannelValue,
+    length: int = 0,
+    offset: int = 0,
+    maxPoints: int = 0,
+    decimation: Decimation = Decimation.STRIDE,
+) -> Optional[List[str]]:
+    return await format_array(
+        root,
+        "stringArray",
+        root.formatter.to_string_array,
+        length,
+        offset,
+        maxPoints,
+        decimation,
+    )
+
+
+async def resolve_binaryArray(
+    root: TypeChannelValue,
+    info: Info,
+    length: int = 0,
+    offset: int = 0,
+    maxPoints: int = 0,
+    decimation: Decimation = Decimation.STRIDE,
+) -> Optional[ArrayFrame]:
+    assert (
+        info.operation.operation == OperationType.SUBSCRIPTION
+    ), "binaryArray can only be sent by websocket subscriptions"
+    return await format_array(
+        root,
+        "binaryArray",
+        root.formatter.to_binary_array,
+        length,
+        offset,
+        maxPoints,
+        decimation,
+    )
+
+
+def resolve_shape(root: TypeChannelValue) -> Optional[List[int]]:
+    if isinstance(root.value, np.ndarray):
+        return list(root.value.shape)
+    return None
 
 
-def resolve_stringArray(root: TypeChannelValue, length: int = 0) -> Optional[List[str]]:
-    return root.formatter.to_string_array(root.value, length)
+def resolve_delta(root: TypeChannelValue) -> Optional[ArrayDelta]:
+    return root.delta
 
 
 @strawberry.type
@@ -60,6 +248,17 @@ class ChannelValue:
     )
     # Array of strings, Null if not expressable
     stringArray: Optional[List[str]] = strawberry.field(resolver=resolve_stringArray)
+    # Array sent as a binary websocket frame, Null if not expressable.
+    # Only available in subscriptions
+    binaryArray: Optional[ArrayFrame] = strawberry.field(
+        resolver=resolve_binaryArray
+    )  # type: ignore
+    # The size of each dimension of an array value, Null if not an array.
+    # The array fields give the elements of each row in turn
+    shape: Optional[List[int]] = strawberry.field(resolver=resolve_shape)
+    # If the array fields are only the elements that changed since the last
+    # update of a delta encoded subscription, where they belong in the array
+    delta: Optional[ArrayDelta] = strawberry.field(resolver=resolve_delta)
 
 
 @strawberry.type
@@ -90,8 +289,9 @@ class ChannelTime(TypeChannelTime):
 
 
 def resolver_id(root: "DeferredChannel") -> Optional[str]:
-    channel = root.get_channel()
-    return channel.get_id()
+    # Use the id the channel was requested with, as plugins are not required to
+    # fill it in on every update
+    return root.id
 
 
 def resolver_value(root: "DeferredChannel") -> Optional[TypeChannelValue]:
@@ -171,23 +371,95 @@ class DeferredChannel(Channel):
 
 
 class GetChannel(DeferredChannel):
-    def __init__(self, channel_id: str, timeout: float, store: PluginStore):
+    def __init__(
+        self,
+        channel_id: str,
+        timeout: float,
+        store: PluginStore,
+        fresh: bool = False,
+        fields: Collection[str] = CHANNEL_FIELDS,
+        count: int = 0,
+    ):
         self.plugin, self.id = store.plugin_config_id(channel_id)
         # Remove the transport prefix from the read pv
         self.pv = store.transport_pv(channel_id)[1]
         self.timeout = timeout
+        self.fresh = fresh
+        self.fields = fields
+        self.count = count
         self.lock = asyncio.Lock()
 
     async def populate_channel(self) -> Channel:
-        channel = await self.plugin.get_channel(self.pv, self.timeout)
+        channel = await self.plugin.get_channel(
+            self.pv, self.timeout, self.fresh, self.fields, self.count
+        )
         # Convert types.Channel object to a Strawberry schema Channel
         strawberry_channel = Channel(channel)
         self.channel = strawberry_channel
         return strawberry_channel
 
 
-async def get_channel(id: strawberry.ID, timeout: float = 5.0) -> Channel:
-    channel = GetChannel(id, timeout, store_global)
+def selected_fields(selections: List[Selection]) -> List[SelectedField]:
+    """The fields selected, including those in fragments"""
+    fields: List[SelectedField] = []
+    for selection in selections:
+        if isinstance(selection, SelectedField):
+            fields.append(selection)
+        else:
+            fields += selected_fields(selection.selections)
+    return fields
+
+
+def selected_names(selections: List[Selection]) -> Set[str]:
+    """The names of the fields selected, including those in fragments"""
+    return {field.name for field in selected_fields(selections)}
+
+
+def channel_selections(info: Info) -> List[Selection]:
+    return [
+        selection for field in info.selected_fields for selection in field.selections
+    ]
+
+
+def selected_channel_fields(info: Info) -> Set[str]:
+    """The top level Channel fields selected for the field being resolved"""
+    return selected_names(channel_selections(info))
+
+
+def selected_array_count(info: Info) -> int:
+    """How many elements from the start of an array value the selected value
+    fields need, or 0 if they need all of it"""
+    count = 0
+    for field in selected_fields(channel_selections(info)):
+        if field.name != "value":
+            continue
+        for value_field in selected_fields(field.selections):
+            # Literal arguments are given as strings
+            length = int(value_field.arguments.get("length") or 0)
+            offset = int(value_field.arguments.get("offset") or 0)
+            if value_field.name in ("base64Array", "stringArray") and length > 0:
+                count = max(count, offset + length)
+            else:
+                # Anything else formats the whole value
+                return 0
+    return count
+
+
+async def get_channel(
+    id: strawberry.ID,
+    info: Info,
+    timeout: float = 5.0,
+    fresh: bool = False,
+    fetchSelected: bool = False,
+) -> Channel:
+    """Get the current value of a Channel. If the Channel is already being
+    monitored its latest values are returned, unless fresh is True. If
+    fetchSelected is True then only the array elements selected by the length
+    and offset of the array fields are fetched. Channel Access pads arrays
+    with fewer elements than that with zeros"""
+    fields = selected_channel_fields(info)
+    count = selected_array_count(info) if fetchSelected else 0
+    channel = GetChannel(id, timeout, store_global, fresh, fields, count)
     await channel.populate_channel()
     return channel
 
@@ -204,19 +476,147 @@ class SubscribeChannel(DeferredChannel):
         self.channel = channel
 
 
-async def subscribe_channel(id: strawberry.ID) -> AsyncGenerator[Channel, None]:
+def min_interval(max_rate: Optional[float]) -> float:
+    """Convert a maximum update rate in Hz to the minimum time between updates"""
+    if max_rate is None:
+        return 0.0
+    assert max_rate > 0, f"maxRate must be positive, not {max_rate}"
+    return 1.0 / max_rate
+
+
+def make_deadband(
+    deadband: Optional[float], deadband_percent: Optional[float]
+) -> Optional[Deadband]:
+    """Make the Deadband for an absolute or percentage of displayRange size"""
+    assert (
+        deadband is None or deadband_percent is None
+    ), "Only one of deadband and deadbandPercent can be given"
+    if deadband is not None:
+        assert deadband >= 0, f"deadband must not be negative, not {deadband}"
+        return Deadband(deadband)
+    elif deadband_percent is not None:
+        assert (
+            deadband_percent >= 0
+        ), f"deadbandPercent must not be negative, not {deadband_percent}"
+        return Deadband(deadband_percent, relative=True)
+    return None
+
+
+async def subscribe_channel(
+    id: strawberry.ID,
+    info: Info,
+    maxRate: Optional[float] = None,
+    deadband: Optional[float] = None,
+    deadbandPercent: Optional[float] = None,
+    events: Optional[List[ChannelEvent]] = None,
+    delta: bool = False,
+    keyframeInterval: int = DELTA_KEYFRAME_INTERVAL,
+    fetchSelected: bool = False,
+) -> AsyncGenerator[Channel, None]:
     """Subscribe to changes in top level fields of Channel,
-    if they haven't changed they will be Null"""
+    if they haven't changed they will be Null. If maxRate is given then
+    updates are sent at most maxRate times a second, merging any changes
+    in between. If deadband, or deadbandPercent of the displayRange, is given
+    then updates where a numeric value has moved less than that are not sent.
+    If events are given then transports that can filter at the source, like
+    Channel Access, only send updates for those kinds of change. If delta is
+    True then array values only contain the elements that changed since the
+    last update, with the complete array every keyframeInterval updates.
+    fetchSelected limits the array elements fetched as in getChannel"""
     store: PluginStore = store_global
     plugin, channel_id = store.plugin_config_id(id)
     # Remove the transport prefix from the read pv
     pv = store.transport_pv(id)[1]
-    async for channel in plugin.subscribe_channel(pv):
+    fields = selected_channel_fields(info)
+    encoder = DeltaEncoder(keyframeInterval) if delta else None
+    async for channel in plugin.subscribe_channel(
+        pv,
+        min_interval(maxRate),
+        fields,
+        make_deadband(deadband, deadbandPercent),
+        events,
+        selected_array_count(info) if fetchSelected else 0,
+    ):
+        if encoder:
+            channel = encoder.encode(channel)
         # Convert types.Channel object to a Strawberry schema Channel
         strawberry_channel = Channel(channel)
         yield SubscribeChannel(channel_id, strawberry_channel)
 
 
+async def subscribe_channels(
+    ids: List[strawberry.ID],
+    info: Info,
+    batch: bool = True,
+    maxRate: Optional[float] = None,
+    deadband: Optional[float] = None,
+    deadbandPercent: Optional[float] = None,
+    events: Optional[List[ChannelEvent]] = None,
+    delta: bool = False,
+    keyframeInterval: int = DELTA_KEYFRAME_INTERVAL,
+    fetchSelected: bool = False,
+) -> AsyncGenerator[List[Channel], None]:
+    """Subscribe to changes in top level fields of a number of Channels at once.
+    Each update contains the Channels that have changed, tagged with their id.
+    If batch is False then each update contains a single Channel. If maxRate
+    is given then each Channel is updated at most maxRate times a second.
+    deadband, deadbandPercent, events, delta, keyframeInterval and fetchSelected
+    apply to each Channel as in subscribeChannel"""
+    store: PluginStore = store_global
+    interval = min_interval(maxRate)
+    channel_deadband = make_deadband(deadband, deadbandPercent)
+    count = selected_array_count(info) if fetchSelected else 0
+    fields = selected_channel_fields(info)
+    # {channel_id: encoder}
+    encoders: Dict[str, DeltaEncoder] = {}
+    # {plugin: {pv: channel_id}}
+    plugin_pvs: Dict[Plugin, Dict[str, str]] = {}
+    for id in ids:
+        plugin, channel_id = store.plugin_config_id(id)
+        # Remove the transport prefix from the read pv
+        pv = store.transport_pv(id)[1]
+        plugin_pvs.setdefault(plugin, {})[pv] = channel_id
+        if delta:
+            encoders[channel_id] = DeltaEncoder(keyframeInterval)
+
+    # Updates from all plugins, keyed by channel_id
+    updates = ChannelUpdates()
+
+    async def _pump(plugin: Plugin, channel_ids: Dict[str, str]):
+        try:
+            async for changes in plugin.subscribe_channels(
+                list(channel_ids), interval, fields, channel_deadband, events, count
+            ):
+                for pv, channel in changes.items():
+                    updates.put(channel_ids[pv], channel)
+        except Exception as e:
+            updates.fail(e)
+
+    tasks = [
+        asyncio.create_task(_pump(plugin, channel_ids))
+        for plugin, channel_ids in plugin_pvs.items()
+    ]
+    try:
+        while True:
+            changes = await updates.get()
+            for channel_id, encoder in encoders.items():
+                if channel_id in changes:
+                    changes[channel_id] = encoder.encode(changes[channel_id])
+            # Convert types.Channel objects to Strawberry schema Channels
+            channels: List[Channel] = [
+                SubscribeChannel(channel_id, Channel(channel))
+                for channel_id, channel in changes.items()
+            ]
+            if batch:
+                yield channels
+            else:
+                for channel in channels:
+                    yield [channel]
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
 @strawberry.type
 class Subscription:
     """Tell mypy to ignore this line as it complains 'expression
@@ -226,6 +626,9 @@ class Subscription:
     subscribeChannel: Optional[Channel] = strawberry.subscription(
         resolver=subscribe_channel
     )  # type: ignore
+    subscribeChannels: List[Channel] = strawberry.subscription(
+        resolver=subscribe_channels
+    )  # type: ignore
 
 
 @strawberry.type
@@ -257,7 +660,10 @@ class Mutation:
                 if isinstance(put_value, dict):
                     # decode base64 array
                     dtype = np.dtype(put_value["numberType"].lower())
-                    value_b = base64.b64decode(put_value["base64"])
+                    compression = Compression(put_value.get("compression", "NONE"))
+                    value_b = DECOMPRESSORS[compression](
+                        base64.b64decode(put_value["base64"])
+                    )
                     # https://stackoverflow.com/a/6485943
                     put_value = np.frombuffer(value_b, dtype=dtype)
             results.append(put_value)
@@ -268,8 +674,9 @@ class Mutation:
             p.transport for p in plugins
         ]
         await plugins.pop().put_channels(pvs, results, timeout)
+        # Monitors may not have seen the put yet, so get the values directly
         channels: Sequence[GetChannel] = [
-            GetChannel(channel_id, timeout, store) for channel_id in ids
+            GetChannel(channel_id, timeout, store, fresh=True) for channel_id in ids
         ]
         for channel in channels:
             await channel.populate_channel()
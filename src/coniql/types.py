@@ -1,13 +1,16 @@
 import base64
+import json
 import math
-import time
-from dataclasses import dataclass
+import struct
+import zlib
+from dataclasses import dataclass, field
 from enum import Enum, IntEnum
-from typing import Any, Callable, List, Optional
+from typing import Any, Callable, Dict, Hashable, List, NewType, Optional, Union
 
 import numpy as np
 import strawberry
 
+from .clock import sim_clock
 from .coniql_schema import DisplayForm, Widget
 
 
@@ -123,6 +126,31 @@ class ChannelRole(Enum):
     RW = "RW"
 
 
+@strawberry.enum
+class Compression(Enum):
+    """
+    How the bytes of an array are compressed before they are base64 encoded
+    """
+
+    NONE = "NONE"
+    ZLIB = "ZLIB"
+
+
+# Fastest zlib level, as the arrays that compress well are mostly runs of the
+# same values and don't gain much from trying harder
+ZLIB_LEVEL = 1
+
+COMPRESSORS: Dict[Compression, Callable[[Any], Any]] = {
+    Compression.NONE: lambda data: data,
+    Compression.ZLIB: lambda data: zlib.compress(data, ZLIB_LEVEL),
+}
+
+DECOMPRESSORS: Dict[Compression, Callable[[Any], Any]] = {
+    Compression.NONE: lambda data: data,
+    Compression.ZLIB: zlib.decompress,
+}
+
+
 @strawberry.type
 @dataclass
 class Base64Array:
@@ -130,6 +158,21 @@ class Base64Array:
     numberType: NumberType
     # Base64 encoded version of the array
     base64: str
+    # How the array was compressed before it was base64 encoded
+    compression: Compression = Compression.NONE
+
+
+@strawberry.type
+@dataclass
+class ArrayDelta:
+    """
+    Where the elements of a delta encoded array value belong in the whole array
+    """
+
+    # The index in the whole array of the first element of the value
+    offset: int
+    # The number of elements in the whole array
+    size: int
 
 
 def make_number_format_string(precision: Optional[int]) -> str:
@@ -146,6 +189,65 @@ def return_none(*args, **kwargs):
     return None
 
 
+# How many values format_all formats in each operation
+FORMAT_CHUNK = 10_000
+
+
+def format_all(
+    precision: Optional[int], values: Union[List[Any], np.ndarray]
+) -> List[str]:
+    """Format every value to the given precision, giving the same strings as the
+    make_number_format_string format, but in a single formatting operation for
+    each FORMAT_CHUNK values. Each operation holds the GIL, so chunking lets the
+    event loop run in between when this is called from a worker thread"""
+    assert precision is not None
+    line_format = "%%.%df\n" % precision
+    strings: List[str] = []
+    for i in range(0, len(values), FORMAT_CHUNK):
+        chunk = values[i : i + FORMAT_CHUNK]
+        # Python numbers format faster than numpy scalars
+        numbers = tuple(chunk.tolist() if isinstance(chunk, np.ndarray) else chunk)
+        strings += (line_format * len(numbers) % numbers).split("\n")[:-1]
+    return strings
+
+
+def array_slice(value: np.ndarray, length: int = 0, offset: int = 0) -> np.ndarray:
+    """The length elements of value starting at offset, or all of them after
+    offset if length is 0. Arrays of more than 1 dimension are flattened first,
+    unless all of them is wanted"""
+    if value.ndim > 1 and (length > 0 or offset > 0):
+        value = value.reshape(-1)
+    if length > 0:
+        return value[offset : offset + length]
+    return value[offset:]
+
+
+@dataclass
+class BinaryFrame:
+    """An array sent as a binary websocket frame ahead of the JSON result that
+    refers to it. The frame is a little-endian uint32 header length, a JSON
+    header with the numberType and shape, then the little-endian array data"""
+
+    data: bytes
+
+
+ArrayFrame = strawberry.scalar(
+    NewType("ArrayFrame", object),
+    description="The index of an array among the binary websocket frames sent "
+    "immediately before this result",
+    parse_value=return_none,
+)
+
+
+def ndarray_to_frame(value: np.ndarray) -> BinaryFrame:
+    header = json.dumps(
+        {"numberType": value.dtype.name.upper(), "shape": list(value.shape)}
+    ).encode()
+    # Only copies the data if it is big-endian or not contiguous
+    data = np.ascontiguousarray(value, dtype=value.dtype.newbyteorder("<"))
+    return BinaryFrame(b"".join([struct.pack("<I", len(header)), header, data.data]))
+
+
 class ChannelFormatter:
     @classmethod
     def for_number(
@@ -169,26 +271,37 @@ class ChannelFormatter:
     def for_ndarray(
         cls, precision: Optional[int], units: Optional[str]
     ) -> "ChannelFormatter":
-        number_format_string = make_number_format_string(precision)
-
         # ndarray -> base64 encoded array
-        def ndarray_to_base64_array(value: np.ndarray, length: int = 0) -> Base64Array:
-            if length > 0:
-                value = value[:length]
+        def ndarray_to_base64_array(
+            value: np.ndarray,
+            length: int = 0,
+            offset: int = 0,
+            compression: Compression = Compression.NONE,
+        ) -> Base64Array:
+            value = array_slice(value, length, offset)
+            # Only copies the data if the slice is not contiguous
+            data = COMPRESSORS[compression](np.ascontiguousarray(value))
             return Base64Array(
-                value.dtype.name.upper(), base64.b64encode(value.tobytes()).decode()
+                value.dtype.name.upper(), base64.b64encode(data).decode(), compression
             )
 
         # ndarray -> [str] uses given precision
-        def ndarray_to_string_array(value: np.ndarray, length: int = 0) -> List[str]:
-            if length > 0:
-                value = value[:length]
-            func = number_format_string.format
-            return [func(x) for x in value]
+        def ndarray_to_string_array(
+            value: np.ndarray, length: int = 0, offset: int = 0
+        ) -> List[str]:
+            value = array_slice(value, length, offset)
+            return format_all(precision, value.reshape(-1))
+
+        # ndarray -> binary websocket frame
+        def ndarray_to_binary_array(
+            value: np.ndarray, length: int = 0, offset: int = 0
+        ) -> BinaryFrame:
+            return ndarray_to_frame(array_slice(value, length, offset))
 
         formatter = cls(
             to_base64_array=ndarray_to_base64_array,
             to_string_array=ndarray_to_string_array,
+            to_binary_array=ndarray_to_binary_array,
         )
 
         return formatter
@@ -208,14 +321,16 @@ class ChannelFormatter:
         to_string: Callable[[Any], str] = str,
         to_string_with_units: Callable[[Any], str] = str,
         to_float: Callable[[Any], Optional[float]] = return_none,
-        to_base64_array: Callable[[Any, int], Optional[Base64Array]] = return_none,
-        to_string_array: Callable[[Any, int], Optional[List[str]]] = return_none,
+        to_base64_array: Callable[..., Optional[Base64Array]] = return_none,
+        to_string_array: Callable[[Any, int, int], Optional[List[str]]] = return_none,
+        to_binary_array: Callable[[Any, int, int], Optional[BinaryFrame]] = return_none,
     ):
         self.to_string = to_string
         self.to_string_with_units = to_string_with_units
         self.to_float = to_float
         self.to_base64_array = to_base64_array
         self.to_string_array = to_string_array
+        self.to_binary_array = to_binary_array
 
 
 @dataclass
@@ -272,7 +387,7 @@ class ChannelTime:
 
     @classmethod
     def now(cls) -> "ChannelTime":
-        now = time.time()
+        now = sim_clock.time()
         return cls(now, int(now % 1 / 1e-9), 0)
 
 
@@ -280,6 +395,16 @@ class ChannelTime:
 class ChannelValue:
     value: Any
     formatter: ChannelFormatter = ChannelFormatter()
+    # If given, value is only the elements of an array that have changed
+    delta: Optional[ArrayDelta] = None
+    # Representations of value already computed, shared by everyone formatting it
+    cache: Dict[Hashable, Any] = field(default_factory=dict, compare=False, repr=False)
+
+    def memoize(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return compute(), only calling it the first time key is asked for"""
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
 
 
 class Channel:
@@ -41,6 +41,12 @@ BASE64_0_1688_2 = {
     "base64": "AAAAAAAAAAA1XrpJDAL7PwAAAAAAAABA",
 }
 
+BASE64_ZLIB_0_1688_2 = {
+    "numberType": "FLOAT64",
+    "base64": "eAFjYIAA07hdnjxMv+2hXAcAI7YDHw==",
+    "compression": "ZLIB",
+}
+
 SUBSCRIPTION_TIMEOUT = 10
 
 
@@ -308,6 +314,22 @@ mutation {
     json.dumps(json.dumps(BASE64_0_1688_2)),
 )
 
+base64_zlib_put_query = """
+mutation {
+    putChannels(ids: ["ca://%swaveform"], values: [%s]) {
+        value {
+            stringArray
+        }
+        time {
+            datetime
+        }
+    }
+}
+""" % (
+    PV_PREFIX,
+    json.dumps(json.dumps(BASE64_ZLIB_0_1688_2)),
+)
+
 base64_put_query_result = {
     "putChannels": [
         {
@@ -1,8 +1,11 @@
 import asyncio
+import json
+import struct
 import time
 from subprocess import Popen
 from typing import Any, Dict, List, Optional
 
+import numpy as np
 import pytest
 from aiohttp.test_utils import TestClient
 from strawberry.subscriptions import GRAPHQL_TRANSPORT_WS_PROTOCOL
@@ -14,11 +17,14 @@ from strawberry.subscriptions.protocols.graphql_transport_ws.types import (
 )
 from strawberry.subscriptions.protocols.graphql_ws import GQL_CONNECTION_KEEP_ALIVE
 
+import coniql.broadcast
+
 from .conftest import (
     PV_PREFIX,
     SUBSCRIPTION_TIMEOUT,
     base64_put_query,
     base64_put_query_result,
+    base64_zlib_put_query,
     check_put_timestamp,
     enum_get_query,
     enum_get_query_result,
@@ -65,8 +71,9 @@ async def test_aiohttp_client_get_pv(
         (long_and_enum_put_query, long_and_enum_put_query_result),
         (list_put_query, list_put_query_result),
         (base64_put_query, base64_put_query_result),
+        (base64_zlib_put_query, base64_put_query_result),
     ],
-    ids=["long_and_enum_query", "list_query", "base64_query"],
+    ids=["long_and_enum_query", "list_query", "base64_query", "base64_zlib_query"],
 )
 async def test_aiohttp_client_put_pv(
     ioc: Popen, client: TestClient, query: str, expected_result: str
@@ -159,3 +166,176 @@ async def test_subscribe_pv(ioc: Popen, client: TestClient, subscription_data):
     subscription_result = get_ticking_subscription_result(startVal)
     for i in range(3):
         assert results[i] == subscription_result[i]
+
+
+@pytest.mark.asyncio
+async def test_subscribe_shared(ioc: Popen, client: TestClient, subscription_data):
+    """Test that clients sending the same subscription share one execution, and
+    that a client joining late still gets a complete first update"""
+    ws_protocol, msg_init, msg_ack, msg_send = subscription_data
+
+    async def receive_data(ws) -> Dict[str, Any]:
+        while True:
+            result = await asyncio.wait_for(
+                ws.receive_json(), timeout=SUBSCRIPTION_TIMEOUT
+            )
+            if result["type"] != GQL_CONNECTION_KEEP_ALIVE:
+                return result["payload"]["data"]["subscribeChannel"]
+
+    async with client.ws_connect("/ws", protocols=[ws_protocol]) as ws1:
+        await ws1.send_json(msg_init)
+        assert await ws1.receive_json() == msg_ack
+        await ws1.send_json(msg_send)
+        first = await receive_data(ws1)
+        assert first["display"]
+
+        async with client.ws_connect("/ws", protocols=[ws_protocol]) as ws2:
+            await ws2.send_json(msg_init)
+            assert await ws2.receive_json() == msg_ack
+            await ws2.send_json(msg_send)
+            late = await receive_data(ws2)
+            assert late["display"] == first["display"]
+
+            operations = [
+                operation
+                for shared in coniql.broadcast.shared_operations.values()
+                for operation in shared.operations.values()
+            ]
+            assert len(operations) == 1
+            assert len(operations[0].queues) == 2
+
+            # Both now get the same ticks
+            assert await receive_data(ws1) == await receive_data(ws2)
+
+
+@pytest.mark.asyncio
+async def test_subscribe_binary_array(client: TestClient):
+    """Test that binaryArray is sent as a binary frame ahead of the result"""
+    query = """
+subscription {
+    subscribeChannel(id: "ssim://sinewave(5.0, 10.0, 20)") {
+        value {
+            binaryArray
+            a: binaryArray
+            stringArray
+        }
+    }
+}
+"""
+    async with client.ws_connect(
+        "/ws", protocols=[GRAPHQL_TRANSPORT_WS_PROTOCOL]
+    ) as ws:
+        await ws.send_json(ConnectionInitMessage().as_dict())
+        assert await ws.receive_json() == ConnectionAckMessage().as_dict()
+        await ws.send_json(
+            SubscribeMessage(
+                id="sub1", payload=SubscribeMessagePayload(query=query)
+            ).as_dict()
+        )
+        frame = await asyncio.wait_for(ws.receive_bytes(), SUBSCRIPTION_TIMEOUT)
+        result = await asyncio.wait_for(ws.receive_json(), SUBSCRIPTION_TIMEOUT)
+        await ws.close()
+
+    value = result["payload"]["data"]["subscribeChannel"]["value"]
+    # The same array selected twice is only sent once
+    assert value["binaryArray"] == value["a"] == 0
+    (header_length,) = struct.unpack("<I", frame[:4])
+    header = json.loads(frame[4 : 4 + header_length])
+    assert header == {"numberType": "FLOAT64", "shape": [20]}
+    array = np.frombuffer(frame[4 + header_length :], dtype="<f8")
+    assert ["%.5f" % x for x in array] == value["stringArray"]
+
+
+async def test_binary_array_query_fails(client: TestClient):
+    query = '{ getChannel(id: "ssim://sinewave") { value { binaryArray } } }'
+    resp = await client.get("/ws", params={"query": query})
+    result = await resp.json()
+    assert result["errors"][0]["message"] == (
+        "binaryArray can only be sent by websocket subscriptions"
+    )
+
+
+@pytest.mark.asyncio
+async def test_result_queue_drops_backlog_when_full():
+    queue = coniql.broadcast.ResultQueue(maxsize=2)
+    for i in range(2):
+        queue.put(coniql.broadcast.EncodedResult(str(i), []))
+    await queue.wait()
+    assert not queue.stale and len(queue.results) == 2
+    queue.put(coniql.broadcast.EncodedResult("2", []))
+    # The subscriber has fallen too far behind, so will get a snapshot
+    assert queue.stale and not queue.results
+    queue.put(coniql.broadcast.EncodedResult("3", []))
+    assert not queue.results
+
+
+@pytest.mark.parametrize(
+    "query, variables, shareable",
+    [
+        ('subscription { subscribeChannel(id: "ssim://sine") { id } }', None, True),
+        (
+            'subscription { subscribeChannel(id: "ssim://sine", delta: true) { id } }',
+            None,
+            False,
+        ),
+        (
+            "subscription ($d: Boolean) "
+            '{ subscribeChannel(id: "ssim://sine", delta: $d) { id } }',
+            {"d": True},
+            False,
+        ),
+        (
+            'subscription { subscribeChannels(ids: ["ssim://sine"]) { id } }',
+            None,
+            False,
+        ),
+        ("subscription {", None, False),
+    ],
+)
+def test_is_shareable(query: str, variables: Optional[Dict[str, Any]], shareable):
+    assert coniql.broadcast.is_shareable(query, variables, None) == shareable
+
+
+@pytest.mark.asyncio
+async def test_subscribe_channels_late_joiner(client: TestClient):
+    """Test that a client joining a subscribeChannels operation late gets the
+    display of every channel, as it is not shared"""
+    ids = json.dumps([f"ssim://sine({i}, 10, 0.1)" for i in range(3)])
+    query = (
+        "subscription { subscribeChannels(ids: %s) { id display { description } } }"
+        % ids
+    )
+
+    async def subscribe(ws) -> None:
+        await ws.send_json(ConnectionInitMessage().as_dict())
+        assert await ws.receive_json() == ConnectionAckMessage().as_dict()
+        await ws.send_json(
+            SubscribeMessage(
+                id="sub1", payload=SubscribeMessagePayload(query=query)
+            ).as_dict()
+        )
+
+    async def receive_displays(ws) -> Dict[str, Any]:
+        displays: Dict[str, Any] = {}
+        while len(displays) < 3:
+            result = await asyncio.wait_for(ws.receive_json(), SUBSCRIPTION_TIMEOUT)
+            for channel in result["payload"]["data"]["subscribeChannels"]:
+                if channel["display"]:
+                    displays[channel["id"]] = channel["display"]
+        return displays
+
+    async with client.ws_connect(
+        "/ws", protocols=[GRAPHQL_TRANSPORT_WS_PROTOCOL]
+    ) as ws1:
+        await subscribe(ws1)
+        first = await receive_displays(ws1)
+        async with client.ws_connect(
+            "/ws", protocols=[GRAPHQL_TRANSPORT_WS_PROTOCOL]
+        ) as ws2:
+            await subscribe(ws2)
+            assert await receive_displays(ws2) == first
+            assert not [
+                operation
+                for shared in coniql.broadcast.shared_operations.values()
+                for operation in shared.operations.values()
+            ]
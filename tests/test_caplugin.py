@@ -1,13 +1,20 @@
 import asyncio
 from subprocess import Popen
-from typing import Any, AsyncIterator, Dict, List, Optional, cast
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional, cast
 
 import pytest
-from aioca import Subscription
+from aioca import DBE_ALARM, FORMAT_CTRL, FORMAT_TIME, Subscription, caput
 from strawberry import Schema
 
+import coniql.caplugin
 from coniql.app import create_schema
-from coniql.caplugin import CAPlugin
+from coniql.caplugin import CA_DEFAULT_EVENTS, CAPlugin, MonitorKey
+from coniql.metrics import (
+    FIRST_UPDATE_TIME,
+    MONITOR_LINGER_HITS,
+    PV_REGISTRY_BYTES,
+    PV_REGISTRY_SIZE,
+)
 from coniql.strawberry_schema import store_global
 
 from .conftest import (
@@ -177,8 +184,14 @@ async def subscribe_task_wrapper(schema: Schema, query: str):
 
 
 @pytest.mark.parametrize("num_subscribers", [1, 5])
-async def test_subscribe_unsubscribe(ioc: Popen, schema: Schema, num_subscribers: int):
-    """Test that cancelling a subscription correctly closes channel monitors"""
+async def test_subscribe_unsubscribe(
+    ioc: Popen, schema: Schema, num_subscribers: int, monkeypatch: pytest.MonkeyPatch
+):
+    """Test that cancelling a subscription correctly closes channel monitors once
+    they have lingered with no subscribers"""
+
+    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
+    monkeypatch.setattr(ca_plugin.subscription_manager, "linger", 1)
 
     # Create subscription(s)
     query = get_longout_subscription_query(PV_PREFIX)
@@ -188,24 +201,500 @@ async def test_subscribe_unsubscribe(ioc: Popen, schema: Schema, num_subscribers
 
     await asyncio.sleep(1)
 
-    # Check the subscription is logged in the manager
-    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
+    # Check the subscription is logged in the manager. No display is selected,
+    # so there is no need for a meta monitor
     pvs = ca_plugin.subscription_manager.pvs
     assert len(pvs.keys()) == 1
+    subscribed = list(pvs.values())
     for pv in pvs.values():
-        assert pv.meta_monitor.state == Subscription.OPEN
-        assert pv.time_monitor.state == Subscription.OPEN
+        assert pv.meta_monitor is None
+        assert pv.time_monitor and pv.time_monitor.state == Subscription.OPEN
         assert pv.subscribers == num_subscribers
 
     # Close subscriptions
     for task in tasks:
         task.cancel()
 
+    await asyncio.sleep(0.5)
+
+    # Check monitors are kept open while lingering
+    for pv in pvs.values():
+        assert pv.time_monitor and pv.time_monitor.state == Subscription.OPEN
+        assert pv.subscribers == 0
+
     await asyncio.sleep(1)
 
-    # Check subscription has been closed
+    # Check subscription has been closed and forgotten
+    assert not ca_plugin.subscription_manager.pvs
+    for pv in subscribed:
+        assert pv.time_monitor and pv.time_monitor.state == Subscription.CLOSED
+        assert pv.subscribers == 0
+
+
+@pytest.mark.asyncio
+async def test_subscribe_channels(ioc: Popen, schema: Schema):
+    """Test that a single subscription to multiple PVs receives all of them, tagged
+    with their ids, and shares monitors with single PV subscriptions"""
+    query = """
+subscription {
+    subscribeChannels(ids: ["ca://%ssi", "ca://%slongout.RTYP", "ca://%ssi"]) {
+        id
+        value {
+            string
+        }
+    }
+}
+""" % (
+        PV_PREFIX,
+        PV_PREFIX,
+        PV_PREFIX,
+    )
+    resp = await schema.subscribe(query)
+    assert isinstance(resp, AsyncIterator)
+    received: Dict[str, Any] = {}
+    while len(received) < 2:
+        result = await asyncio.wait_for(resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT)
+        assert result.errors is None
+        assert result.data
+        for channel in result.data["subscribeChannels"]:
+            received[channel["id"]] = channel["value"]
+    assert received == {
+        f"ca://{PV_PREFIX}si": {"string": "me"},
+        f"ca://{PV_PREFIX}longout.RTYP": {"string": "longout"},
+    }
+
+    # Duplicate ids only subscribe once
+    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
     pvs = ca_plugin.subscription_manager.pvs
+    assert sorted(pvs) == [
+        MonitorKey(PV_PREFIX + "longout.RTYP"),
+        MonitorKey(PV_PREFIX + "si"),
+    ]
+    for pv in pvs.values():
+        assert pv.subscribers == 1
+
+    await cast(AsyncGenerator, resp).aclose()
+    await asyncio.sleep(0.1)
     for pv in pvs.values():
-        assert pv.meta_monitor.state == Subscription.CLOSED
-        assert pv.time_monitor.state == Subscription.CLOSED
         assert pv.subscribers == 0
+
+
+@pytest.mark.asyncio
+async def test_subscribe_max_rate(ioc: Popen, schema: Schema):
+    """Test that maxRate merges updates that happen faster than it allows"""
+    query = ticking_subscription_query.replace('ticking")', 'ticking", maxRate: 0.5)')
+    resp = await schema.subscribe(query)
+    assert isinstance(resp, AsyncIterator)
+    results = []
+    for _ in range(2):
+        result = await asyncio.wait_for(resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT)
+        assert result.data
+        results.append(result.data["subscribeChannel"])
+    # Ticks every 0.5s, so at least 3 ticks are merged into the second update
+    assert results[1]["value"]["float"] - results[0]["value"]["float"] >= 3
+    assert results[1]["display"] is None
+
+
+@pytest.mark.asyncio
+async def test_subscribe_deadband(ioc: Popen, schema: Schema):
+    """Test that updates within the deadband of the last one sent are dropped"""
+    query = ticking_subscription_query.replace('ticking")', 'ticking", deadband: 2.5)')
+    resp = await schema.subscribe(query)
+    assert isinstance(resp, AsyncIterator)
+    values = []
+    for _ in range(3):
+        result = await asyncio.wait_for(resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT)
+        assert result.data
+        values.append(result.data["subscribeChannel"]["value"]["float"])
+    await cast(AsyncGenerator, resp).aclose()
+    # Ticks by 1 every 0.5s, so only every third tick is outside the deadband
+    assert values[1] - values[0] == 3
+    assert values[2] - values[1] == 3
+
+
+@pytest.mark.asyncio
+async def test_subscribe_events(ioc: Popen, schema: Schema):
+    """Test that subscriptions asking for different events get their own value
+    monitors, with the event mask applied by the IOC"""
+    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
+    manager = ca_plugin.subscription_manager
+    pv = PV_PREFIX + "ticking"
+    alarm_query = ticking_subscription_query.replace(
+        'ticking")', 'ticking", events: [ALARM])'
+    )
+    alarm_resp = await schema.subscribe(alarm_query)
+    value_resp = await schema.subscribe(ticking_subscription_query)
+    assert isinstance(alarm_resp, AsyncIterator)
+    assert isinstance(value_resp, AsyncIterator)
+    for resp in (alarm_resp, value_resp):
+        result = await asyncio.wait_for(resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT)
+        assert result.data and result.data["subscribeChannel"]["value"]
+    assert sorted(manager.pvs) == [MonitorKey(pv, DBE_ALARM), MonitorKey(pv)]
+    assert manager.pvs[MonitorKey(pv)].key.events == CA_DEFAULT_EVENTS
+
+    # The value ticks, but the alarm state never changes
+    result = await asyncio.wait_for(
+        value_resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT
+    )
+    assert result.data and result.data["subscribeChannel"]["value"]
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(alarm_resp.__anext__(), timeout=1.5)
+    await cast(AsyncGenerator, value_resp).aclose()
+
+
+@pytest.mark.asyncio
+async def test_subscribe_linger(
+    ioc: Popen, schema: Schema, monkeypatch: pytest.MonkeyPatch
+):
+    """Test that resubscribing while monitors linger reuses them"""
+    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
+    manager = ca_plugin.subscription_manager
+    monkeypatch.setattr(manager, "linger", 0.5)
+    pv = PV_PREFIX + "longout.RTYP"
+    query = """
+subscription {
+    subscribeChannel(id: "ca://%s") {
+        value {
+            string
+        }
+    }
+}
+""" % (pv)
+    MONITOR_LINGER_HITS.set({}, 0)
+
+    for _ in range(2):
+        resp = await schema.subscribe(query)
+        assert isinstance(resp, AsyncIterator)
+        result = await asyncio.wait_for(resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT)
+        assert result.data == {"subscribeChannel": {"value": {"string": "longout"}}}
+        await cast(AsyncGenerator, resp).aclose()
+        await asyncio.sleep(0.1)
+        data = manager.pvs[MonitorKey(pv)]
+        assert data.subscribers == 0
+        assert data.linger
+        assert data.time_monitor and data.time_monitor.state == Subscription.OPEN
+
+    assert MONITOR_LINGER_HITS.get({}) == 1
+
+    await asyncio.sleep(1)
+    assert data.linger is None
+    assert data.time_monitor and data.time_monitor.state == Subscription.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_subscribe_forgets_closed(
+    ioc: Popen, schema: Schema, monkeypatch: pytest.MonkeyPatch
+):
+    """Test that PVs are forgotten once their monitors are closed"""
+    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
+    manager = ca_plugin.subscription_manager
+    monkeypatch.setattr(manager, "linger", 0)
+
+    query = get_longout_subscription_query(PV_PREFIX).replace("longout", "si")
+    resp = await schema.subscribe(query)
+    assert isinstance(resp, AsyncIterator)
+    await asyncio.wait_for(resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT)
+    manager.update_registry_metrics()
+    assert PV_REGISTRY_SIZE.get({}) == 1
+    assert cast(int, PV_REGISTRY_BYTES.get({})) > 0
+
+    await cast(AsyncGenerator, resp).aclose()
+    await asyncio.sleep(0.1)
+    assert not manager.pvs
+    assert not manager.locks
+
+    manager.update_registry_metrics()
+    assert PV_REGISTRY_SIZE.get({}) == 0
+    assert PV_REGISTRY_BYTES.get({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_get_from_live_monitor(
+    ioc: Popen, schema: Schema, monkeypatch: pytest.MonkeyPatch
+):
+    """Test that a get on a monitored PV is answered without any CA requests,
+    unless fresh values are asked for"""
+    subscription = (
+        get_longout_subscription_query(PV_PREFIX)
+        .replace("longout", "longout.RTYP")
+        .replace("status {", "display { description } status {")
+    )
+    resp = await schema.subscribe(subscription)
+    assert isinstance(resp, AsyncIterator)
+    await asyncio.wait_for(resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT)
+
+    async def no_ca(*args, **kwargs):
+        raise AssertionError("Unexpected CA request")
+
+    monkeypatch.setattr(coniql.caplugin, "caget", no_ca)
+    monkeypatch.setattr(coniql.caplugin, "cainfo", no_ca)
+
+    result = await schema.execute(longout_str_get_query)
+    assert result.data == longout_str_get_query_result
+
+    query = longout_str_get_query.replace('RTYP")', 'RTYP", fresh: true)')
+    result = await schema.execute(query)
+    assert result.errors
+    assert result.errors[0].message == "Unexpected CA request"
+
+    await cast(AsyncGenerator, resp).aclose()
+
+
+@pytest.mark.asyncio
+async def test_value_subscription_refreshes_metadata(
+    ioc: Popen, schema: Schema, monkeypatch: pytest.MonkeyPatch
+):
+    """Test that a subscription without a metadata monitor is not used to answer
+    gets, and fetches its metadata again when it expires"""
+    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
+    manager = ca_plugin.subscription_manager
+    monkeypatch.setattr(manager.metadata, "ttl", 0.1)
+    pv = PV_PREFIX + "waveform"
+    await caput(pv, [1, 2])
+    query = 'subscription { subscribeChannel(id: "ca://%s") { value { stringArray } } }'
+    resp = await schema.subscribe(query % pv)
+    assert isinstance(resp, AsyncIterator)
+    try:
+        result = await asyncio.wait_for(resp.__anext__(), SUBSCRIPTION_TIMEOUT)
+        assert result.data["subscribeChannel"]["value"]["stringArray"] == ["1.0", "2.0"]
+        assert manager.live_data(pv) is None
+
+        await caput(pv + ".PREC", 3)
+        await asyncio.sleep(0.2)
+        for values in ([3, 4], [5, 6]):
+            await caput(pv, values)
+            result = await asyncio.wait_for(resp.__anext__(), SUBSCRIPTION_TIMEOUT)
+            await asyncio.sleep(0.1)
+        assert result.data["subscribeChannel"]["value"]["stringArray"] == [
+            "5.000",
+            "6.000",
+        ]
+    finally:
+        await caput(pv + ".PREC", 1)
+        await cast(AsyncGenerator, resp).aclose()
+
+
+@pytest.mark.asyncio
+async def test_get_metadata_cached(
+    ioc: Popen, schema: Schema, monkeypatch: pytest.MonkeyPatch
+):
+    """Test that a repeated get only fetches the time value, until the cached
+    metadata is invalidated"""
+    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
+    metadata = ca_plugin.subscription_manager.metadata
+    first = await query_schema(schema, longout_get_query)
+    assert first
+
+    formats: List[int] = []
+    caget = coniql.caplugin.caget
+
+    async def recording_caget(pv, **kwargs):
+        formats.append(kwargs["format"])
+        return await caget(pv, **kwargs)
+
+    async def no_cainfo(*args, **kwargs):
+        raise AssertionError("Unexpected cainfo request")
+
+    monkeypatch.setattr(coniql.caplugin, "caget", recording_caget)
+    monkeypatch.setattr(coniql.caplugin, "cainfo", no_cainfo)
+
+    assert await query_schema(schema, longout_get_query) == first
+    assert formats == [FORMAT_TIME]
+
+    metadata.invalidate(PV_PREFIX + "longout")
+    result = await schema.execute(longout_get_query)
+    assert result.errors
+    assert result.errors[0].message == "Unexpected cainfo request"
+
+
+@pytest.mark.asyncio
+async def test_subscribe_writeable_lookup_concurrent(
+    ioc: Popen, schema: Schema, monkeypatch: pytest.MonkeyPatch
+):
+    """Test that monitors are opened while the write access is looked up, and
+    that the first update still waits for it. The manager must hold the lookup
+    task until it is done"""
+    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
+    manager = ca_plugin.subscription_manager
+    pv = PV_PREFIX + "longout.RTYP"
+    query = """
+subscription {
+    subscribeChannel(id: "ca://%s") {
+        status {
+            mutable
+        }
+    }
+}
+""" % (pv)
+    cainfo = coniql.caplugin.cainfo
+    lookups: List[asyncio.Task] = []
+
+    async def slow_cainfo(pv):
+        lookup = asyncio.current_task()
+        assert lookup and lookup in manager.task_references
+        lookups.append(lookup)
+        # Monitors have already been created
+        time_monitor = manager.pvs[MonitorKey(pv)].time_monitor
+        assert time_monitor and time_monitor.state != Subscription.CLOSED
+        info = await cainfo(pv)
+        await asyncio.sleep(0.2)
+        monkeypatch.setattr(info, "write", False)
+        return info
+
+    monkeypatch.setattr(coniql.caplugin, "cainfo", slow_cainfo)
+
+    def first_update_count() -> int:
+        try:
+            return FIRST_UPDATE_TIME.get({"monitors": "new"})["count"]
+        except KeyError:
+            # Nothing observed yet
+            return 0
+
+    count = first_update_count()
+
+    resp = await schema.subscribe(query)
+    assert isinstance(resp, AsyncIterator)
+    result = await asyncio.wait_for(resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT)
+    assert result.data == {"subscribeChannel": {"status": {"mutable": False}}}
+    assert first_update_count() == count + 1
+    assert lookups and lookups[0] not in manager.task_references
+    await cast(AsyncGenerator, resp).aclose()
+
+
+@pytest.mark.asyncio
+async def test_get_only_selected(
+    ioc: Popen, schema: Schema, monkeypatch: pytest.MonkeyPatch
+):
+    """Test that a get only makes the CA requests needed for the fields selected"""
+    formats: List[int] = []
+    caget = coniql.caplugin.caget
+
+    async def recording_caget(pv, **kwargs):
+        formats.append(kwargs["format"])
+        return await caget(pv, **kwargs)
+
+    async def no_cainfo(*args, **kwargs):
+        raise AssertionError("Unexpected cainfo request")
+
+    monkeypatch.setattr(coniql.caplugin, "caget", recording_caget)
+    monkeypatch.setattr(coniql.caplugin, "cainfo", no_cainfo)
+
+    assert await query_schema(schema, nan_get_query) == nan_get_query_result
+    assert formats == [FORMAT_CTRL]
+
+    formats.clear()
+    query = nan_get_query.replace("float", "float } time { seconds")
+    result = await query_schema(schema, query)
+    assert result and result["getChannel"]["time"]["seconds"] > 0
+    assert sorted(formats) == sorted([FORMAT_TIME, FORMAT_CTRL])
+
+
+@pytest.mark.asyncio
+async def test_get_missing_pv_id_only(ioc: Popen, schema: Schema):
+    """Test that a get of a missing PV fails even if only its id is selected"""
+    query = 'query { getChannel(id: "ca://%sNO:SUCH:PV", timeout: 0.5) { id } }'
+    result = await schema.execute(query % PV_PREFIX)
+    assert result.errors
+
+
+@pytest.mark.asyncio
+async def test_array_count(ioc: Popen, schema: Schema, monkeypatch: pytest.MonkeyPatch):
+    """Test that only the array elements selected are requested over CA, when
+    asked to"""
+    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
+    manager = ca_plugin.subscription_manager
+    pv = PV_PREFIX + "waveform"
+    await caput(pv, [1, 2, 3, 4, 5])
+    counts: List[int] = []
+    caget = coniql.caplugin.caget
+
+    async def recording_caget(pv, **kwargs):
+        counts.append(kwargs["count"])
+        return await caget(pv, **kwargs)
+
+    monkeypatch.setattr(coniql.caplugin, "caget", recording_caget)
+    selection = """
+        value {
+            stringArray(length: 2, offset: 1)
+            base64Array(length: 1) {
+                numberType
+            }
+        }
+"""
+    get_query = 'query { getChannel(id: "ca://%s", fetchSelected: true) { %s } }' % (
+        pv,
+        selection,
+    )
+    result = await query_schema(schema, get_query)
+    assert result["getChannel"]["value"]["stringArray"] == ["2.0", "3.0"]
+    assert counts == [3]
+
+    subscribe_query = (
+        'subscription { subscribeChannel(id: "ca://%s", fetchSelected: true) { %s } }'
+        % (pv, selection)
+    )
+    resp = await schema.subscribe(subscribe_query)
+    assert isinstance(resp, AsyncIterator)
+    result = await asyncio.wait_for(resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT)
+    assert result.data
+    assert result.data["subscribeChannel"]["value"]["stringArray"] == ["2.0", "3.0"]
+    data = manager.pvs[MonitorKey(pv, elements=3)]
+    assert data.time_value is not None and len(data.time_value) == 3
+
+    # Selecting anything else needs the whole array
+    query = get_query.replace("stringArray(length: 2, offset: 1)", "string")
+    counts.clear()
+    await query_schema(schema, query)
+    assert counts == [0]
+    await cast(AsyncGenerator, resp).aclose()
+
+
+@pytest.mark.asyncio
+async def test_array_length_keeps_nord(ioc: Popen, schema: Schema):
+    """Test that without fetchSelected, a length longer than the waveform gives
+    only the elements it holds rather than padding them"""
+    pv = PV_PREFIX + "waveform"
+    await caput(pv, [1, 2, 3])
+    query = 'query { getChannel(id: "ca://%s") { value { stringArray(length: 10) } } }'
+    result = await query_schema(schema, query % pv)
+    assert result["getChannel"]["value"]["stringArray"] == ["1.0", "2.0", "3.0"]
+
+
+@pytest.mark.asyncio
+async def test_subscribe_only_selected(ioc: Popen, schema: Schema):
+    """Test that subscriptions only open the monitors for the fields they select,
+    and share them when they overlap"""
+    ca_plugin: CAPlugin = cast(CAPlugin, store_global.plugins["ca"])
+    manager = ca_plugin.subscription_manager
+    pv = PV_PREFIX + "longout"
+    query = """
+subscription {
+    subscribeChannel(id: "ca://%s") {
+        %s
+    }
+}
+"""
+    display_query = query % (pv, "display { units }")
+    value_query = query % (pv, "value { string }")
+
+    display_resp = await schema.subscribe(display_query)
+    assert isinstance(display_resp, AsyncIterator)
+    result = await asyncio.wait_for(
+        display_resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT
+    )
+    assert result.data == {"subscribeChannel": {"display": {"units": ""}}}
+    data = manager.pvs[MonitorKey(pv)]
+    assert data.time_monitor is None
+    assert data.meta_monitor
+
+    value_resp = await schema.subscribe(value_query)
+    assert isinstance(value_resp, AsyncIterator)
+    result = await asyncio.wait_for(
+        value_resp.__anext__(), timeout=SUBSCRIPTION_TIMEOUT
+    )
+    assert result.data and result.data["subscribeChannel"]["value"]["string"]
+    assert data.time_monitor
+    assert data.meta_task is None
+
+    await cast(AsyncGenerator, display_resp).aclose()
+    await cast(AsyncGenerator, value_resp).aclose()
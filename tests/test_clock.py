@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import pytest
+
+from coniql.clock import SimClock, sim_clock
+from coniql.simplugin import SimPlugin, SineWaveSim
+from coniql.types import ChannelTime
+
+
+@pytest.mark.asyncio
+async def test_virtual_clock_wakes_sleepers_in_order():
+    clock = SimClock()
+    clock.set_virtual(1000.0)
+    woken = []
+
+    async def sleeper(name: str, when: float):
+        await clock.sleep_until(when)
+        woken.append((name, clock.time()))
+
+    await asyncio.gather(sleeper("b", 3000.0), sleeper("a", 2000.0))
+    assert woken == [("a", 2000.0), ("b", 3000.0)]
+
+
+@pytest.fixture
+def virtual_clock():
+    sim_clock.set_virtual(0.0)
+    yield sim_clock
+    sim_clock.set_real()
+
+
+@pytest.mark.asyncio
+async def test_sims_run_faster_than_real_time(virtual_clock: SimClock):
+    plugin = SimPlugin()
+    pv = "sine(-5, 5, 10, 1.0)"
+    start = time.time()
+    subscription = plugin.subscribe_channel(pv)
+    updates = [await subscription.__anext__() for _ in range(101)]
+    await subscription.aclose()
+    # 100 seconds of updates in much less real time
+    assert time.time() - start < 5
+    assert updates[-1].get_time().seconds == 100.0
+    # The sim carries on ticking in virtual time
+    assert ChannelTime.now().seconds == virtual_clock.time() >= 100.0
+    virtual_clock.set_virtual(0.0)
+    sim = SineWaveSim(period_seconds=100, update_seconds=1)
+    virtual_clock.set_virtual(25.0)
+    assert sim.compute_changes().get_value().value[0] == pytest.approx(5.0)
+    for task in list(plugin.task_references):
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_virtual_clock_waits_for_listeners(virtual_clock: SimClock):
+    plugin = SimPlugin()
+    subscription = plugin.subscribe_channel("counter(1)")
+    values = []
+    for _ in range(50):
+        channel = await subscription.__anext__()
+        values.append(channel.get_value().value)
+        # A slow subscriber, like one sending each update over a websocket
+        for _ in range(3):
+            await asyncio.sleep(0)
+    listener = next(iter(plugin.listeners["counter(1)"]))
+    assert listener.dropped == 0
+    assert values == list(range(values[0], values[0] + 50))
+    await subscription.aclose()
+    for task in list(plugin.task_references):
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_real_clock_yields_when_due():
+    clock = SimClock()
+    ran = []
+
+    async def other():
+        ran.append(True)
+
+    task = asyncio.create_task(other())
+    await clock.sleep_until(0.0)
+    assert ran
+    await task
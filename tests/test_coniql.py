@@ -3,6 +3,7 @@ import base64
 import subprocess
 import sys
 import time
+import zlib
 from pathlib import Path
 from typing import AsyncIterator
 
@@ -11,8 +12,16 @@ import pytest
 from graphql import SourceLocation
 from strawberry import Schema
 
+import coniql.strawberry_schema
 from coniql import __version__
 from coniql.app import create_schema
+from coniql.metrics import (
+    ARRAY_CACHE_BYTES_SAVED,
+    ARRAY_CACHE_HITS,
+    OFFLOAD_QUEUE_DEPTH,
+    OFFLOAD_TIME,
+)
+from coniql.types import ChannelFormatter
 
 TEST_DIR = Path(__file__).resolve().parent
 
@@ -106,6 +115,30 @@ subscription {
     assert len(results) == 3
 
 
+@pytest.mark.asyncio
+async def test_subscribe_sim_sine_max_rate(schema: Schema):
+    query = """
+subscription {
+    subscribeChannel(id: "ssim://sine(-5, 5, 100, 0.02)", maxRate: 5) {
+        value {
+            float
+        }
+    }
+}
+"""
+    results = []
+    start = time.time()
+    resp = await schema.subscribe(query)
+    assert isinstance(resp, AsyncIterator)
+    async for result in resp:
+        results.append(result.data)
+        if time.time() - start > 1:
+            break
+    # Sim updates at 50Hz, but only the first and 5 in the next second are sent
+    assert len(results) <= 7
+    assert results[0] == {"subscribeChannel": {"value": {"float": 0.0}}}
+
+
 @pytest.mark.asyncio
 async def test_subscribe_ramp_wave(schema: Schema):
     query = """
@@ -137,6 +170,69 @@ subscription {
         assert results[i] == {"subscribeChannel": {"value": {"stringArray": x}}}
 
 
+@pytest.mark.asyncio
+async def test_subscribe_ramp_wave_delta(schema: Schema):
+    query = """
+subscription {
+    subscribeChannel(id: "ssim://rampwave(3, 0.1)", delta: true, keyframeInterval: 3) {
+        value {
+            stringArray
+            delta {
+                offset
+                size
+            }
+        }
+    }
+}
+"""
+    results = []
+    resp = await schema.subscribe(query)
+    assert isinstance(resp, AsyncIterator)
+    async for result in resp:
+        assert result.data is not None
+        results.append(result.data["subscribeChannel"]["value"])
+        if len(results) == 4:
+            break
+    # Every element of a ramp changes, so deltas contain the whole array
+    delta = {"offset": 0, "size": 3}
+    assert [r["delta"] for r in results] == [None, delta, delta, None]
+    assert results[3]["stringArray"] == ["3.00000", "4.00000", "5.00000"]
+
+
+@pytest.mark.asyncio
+async def test_subscribe_sim_channels(schema: Schema):
+    query = """
+subscription {
+    subscribeChannels(ids: ["ssim://sine(-5,5,10,0.1)", "ssim://rampwave(3, 0.25)"]) {
+        id
+        value {
+            float
+            stringArray
+        }
+    }
+}
+"""
+    results = []
+    resp = await schema.subscribe(query)
+    assert isinstance(resp, AsyncIterator)
+    async for result in resp:
+        assert result.data
+        results.extend(result.data["subscribeChannels"])
+        if len(results) >= 5:
+            break
+    # Updates are tagged with their id, even though sims only send changed fields
+    sine = [r for r in results if r["id"] == "ssim://sine(-5,5,10,0.1)"]
+    ramp = [r for r in results if r["id"] == "ssim://rampwave(3, 0.25)"]
+    assert sine[0]["value"] == {"float": 0.0, "stringArray": None}
+    assert [r["value"]["stringArray"] for r in ramp] == [
+        ["0.00000", "1.00000", "2.00000"],
+        ["1.00000", "2.00000", "3.00000"],
+        ["2.00000", "3.00000", "4.00000"],
+        ["3.00000", "4.00000", "5.00000"],
+    ][: len(ramp)]
+    assert len(sine) + len(ramp) == len(results)
+
+
 @pytest.mark.asyncio
 async def test_get_sim_sinewave(schema: Schema):
     query = """
@@ -186,6 +282,137 @@ query {
     }
 
 
+@pytest.mark.asyncio
+async def test_get_sim_sinewave_decimated(schema: Schema):
+    query = """
+query {
+    getChannel(id: "ssim://sinewave(1, 100, 1000)") {
+        value {
+            stringArray(maxPoints: 10, decimation: MINMAX)
+            base64Array(length: 500, maxPoints: 20, decimation: LTTB) {
+                numberType
+                base64
+            }
+        }
+    }
+}
+"""
+    result = await schema.execute(query)
+    assert result.data is not None
+    value = result.data["getChannel"]["value"]
+    # A new sinewave is all zeros
+    assert value["stringArray"] == ["%.5f" % x for x in np.zeros(10)]
+    b64s = value["base64Array"]["base64"]
+    assert np.frombuffer(base64.b64decode(b64s), dtype=np.float64).shape == (20,)
+
+
+@pytest.mark.asyncio
+async def test_get_sim_sinewave_compressed(schema: Schema):
+    query = """
+query {
+    getChannel(id: "ssim://sinewave(1, 100, 1000)") {
+        value {
+            base64Array(compression: ZLIB) {
+                numberType
+                base64
+                compression
+            }
+            raw: base64Array {
+                compression
+            }
+        }
+    }
+}
+"""
+    result = await schema.execute(query)
+    assert result.data is not None
+    value = result.data["getChannel"]["value"]
+    assert value["raw"]["compression"] == "NONE"
+    assert value["base64Array"]["compression"] == "ZLIB"
+    b64s = value["base64Array"]["base64"]
+    # A new sinewave is all zeros, so compresses very well
+    assert len(b64s) < 100
+    data = zlib.decompress(base64.b64decode(b64s))
+    assert np.array_equal(np.frombuffer(data, dtype=np.float64), np.zeros(1000))
+
+
+@pytest.mark.asyncio
+async def test_get_sim_sinewave_shares_encoding(schema: Schema):
+    query = """
+query {
+    getChannel(id: "ssim://sinewave(1, 100, 1000)") {
+        value {
+            first: base64Array(length: 100) {
+                base64
+            }
+            second: base64Array(length: 100) {
+                base64
+            }
+        }
+    }
+}
+"""
+    labels = {"field": "base64Array"}
+    ARRAY_CACHE_HITS.set(labels, 0)
+    ARRAY_CACHE_BYTES_SAVED.set(labels, 0)
+    result = await schema.execute(query)
+    assert result.data is not None
+    value = result.data["getChannel"]["value"]
+    assert value["first"] == value["second"]
+    assert ARRAY_CACHE_HITS.get(labels) == 1
+    assert ARRAY_CACHE_BYTES_SAVED.get(labels) == len(value["first"]["base64"])
+
+
+@pytest.mark.asyncio
+async def test_get_sim_sinewave_offloaded(
+    schema: Schema, monkeypatch: pytest.MonkeyPatch
+):
+    query = """
+query {
+    getChannel(id: "ssim://sinewave(1, 100, 2000)") {
+        value {
+            stringArray(length: 2)
+            base64Array {
+                base64
+            }
+        }
+    }
+}
+"""
+    offloader = coniql.strawberry_schema.array_offloader
+    monkeypatch.setattr(offloader, "threshold", 1000)
+    OFFLOAD_QUEUE_DEPTH.set({}, 0)
+    offloaded = OFFLOAD_TIME.get({})["count"] if OFFLOAD_TIME.values else 0
+    result = await schema.execute(query)
+    assert result.data == {
+        "getChannel": {
+            "value": {
+                "stringArray": ["0.00000", "0.00000"],
+                "base64Array": {
+                    "base64": base64.b64encode(np.zeros(2000).tobytes()).decode()
+                },
+            }
+        }
+    }
+    # Only the whole array is big enough, not the 2 elements of stringArray
+    assert OFFLOAD_TIME.get({})["count"] == offloaded + 1
+    assert OFFLOAD_QUEUE_DEPTH.get({}) == 0
+    assert offloader.queued == 0
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        np.array([0.0, -0.0, 1.5, -2.25e10, 1e-12, np.nan, np.inf, -np.inf]),
+        np.arange(-3, 3, dtype=np.int16),
+        np.array([], dtype=np.float32),
+    ],
+)
+def test_string_array_matches_number_format(value: np.ndarray):
+    to_string_array = ChannelFormatter.for_ndarray(3, "mm").to_string_array
+    assert to_string_array(value, 0, 0) == ["{:.3f}".format(x) for x in value]
+
+
 def test_cli_version():
     cmd = [sys.executable, "-m", "coniql", "--version"]
     assert subprocess.check_output(cmd).decode().strip() == __version__
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from coniql.decimation import Decimation, decimate
+
+
+@pytest.mark.parametrize("decimation", list(Decimation))
+def test_decimate_short_array_unchanged(decimation: Decimation):
+    value = np.arange(10, dtype=np.int32)
+    assert decimate(value, 10, decimation) is value
+    assert decimate(value, 0, decimation) is value
+
+
+def test_decimate_stride():
+    value = np.arange(10, dtype=np.int32)
+    assert decimate(value, 4, Decimation.STRIDE).tolist() == [0, 3, 6, 9]
+
+
+def test_decimate_minmax_keeps_peaks():
+    value = np.zeros(1000)
+    value[123] = 5
+    value[877] = -5
+    decimated = decimate(value, 10, Decimation.MINMAX)
+    assert len(decimated) == 10
+    assert decimated.max() == 5
+    assert decimated.min() == -5
+    assert decimated[1] == 5 and decimated[8] == -5
+
+
+def test_decimate_lttb():
+    x = np.linspace(0, 4 * np.pi, 10000)
+    value = np.sin(x).astype(np.float32)
+    decimated = decimate(value, 100, Decimation.LTTB)
+    assert len(decimated) == 100
+    assert decimated.dtype == np.float32
+    # End points are kept, and the shape is kept close to the extremes
+    assert decimated[0] == value[0] and decimated[-1] == value[-1]
+    assert decimated.max() > 0.99 and decimated.min() < -0.99
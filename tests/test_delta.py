@@ -0,0 +1,46 @@
+import numpy as np
+
+from coniql.delta import DeltaEncoder, changed_range
+from coniql.types import ArrayDelta, ChannelFormatter, ChannelValue
+
+
+def test_changed_range():
+    old = np.array([1.0, np.nan, 2.0, 3.0, 4.0])
+    new = old.copy()
+    # NaNs in the same place are not a change
+    assert changed_range(old, new) == (0, 0)
+    new[2] = 5.0
+    new[3] = 6.0
+    assert changed_range(old, new) == (2, 4)
+    new[0] = 0.0
+    new[-1] = 0.0
+    assert changed_range(old, new) == (0, 5)
+
+
+def test_delta_encoder_keyframes():
+    formatter = ChannelFormatter.for_ndarray(1, "")
+    encoder = DeltaEncoder(keyframe_interval=3)
+    value = np.arange(10, dtype=np.int32)
+    values = []
+    for i in range(5):
+        value = value.copy()
+        value[i + 2] = -1
+        values.append(encoder.encode_value(ChannelValue(value, formatter)))
+    # Complete array every 3 updates
+    assert values[0].delta is None and values[3].delta is None
+    assert values[0].value.tolist() == [0, 1, -1, 3, 4, 5, 6, 7, 8, 9]
+    # The others only have the elements that changed
+    assert values[1].delta == ArrayDelta(3, 10)
+    assert values[1].value.tolist() == [-1]
+    assert values[4].delta == ArrayDelta(6, 10)
+    assert values[4].formatter.to_string_array(values[4].value) == ["-1.0"]
+
+
+def test_delta_encoder_size_change():
+    encoder = DeltaEncoder()
+    encoder.encode_value(ChannelValue(np.zeros(10)))
+    assert encoder.encode_value(ChannelValue(np.ones(10))).delta == ArrayDelta(0, 10)
+    assert encoder.encode_value(ChannelValue(np.ones(5))).delta is None
+    # Scalars pass through
+    assert encoder.encode_value(ChannelValue(1.0)).value == 1.0
+    assert encoder.encode_value(ChannelValue(np.ones(5))).delta is None
@@ -6,6 +6,7 @@ from aiohttp.test_utils import TestClient
 from aioprometheus import REGISTRY
 
 import coniql.app
+import coniql.broadcast
 import coniql.metrics
 from coniql.metrics import (
     ACTIVE_CHANNELS,
@@ -26,8 +27,10 @@ def clear_metrics():
     REGISTRY.clear()
     # Must forcibly reload the modules in order to a) recreate the metrics and
     # b) re-create the "metrics_middleware" wrapped function that is used when
-    # creating the application.
+    # creating the application. The handlers that subclass the metrics ones
+    # must then be reloaded too.
     importlib.reload(coniql.metrics)
+    importlib.reload(coniql.broadcast)
     importlib.reload(coniql.app)
     yield
     REGISTRY.clear()
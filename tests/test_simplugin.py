@@ -0,0 +1,162 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import coniql.simplugin
+from coniql.metrics import DROPPED_UPDATES
+from coniql.simplugin import (
+    CounterSim,
+    NoiseSim,
+    RampWaveSim,
+    SimChannel,
+    SimListener,
+    SimPlugin,
+    SineSim,
+)
+from coniql.types import ChannelStatus, ChannelValue
+
+
+@pytest.mark.asyncio
+async def test_sims_with_same_update_seconds_share_a_task():
+    plugin = SimPlugin()
+    for pv in [
+        "sine(-5, 5, 10, 0.1)",
+        "sine(-1, 1, 10, 0.1)",
+        "sinewave(1, 10, 50, 0.1)",
+    ]:
+        await plugin.get_channel(pv, 0)
+    await plugin.get_channel("sine(-5, 5, 10, 0.2)", 0)
+    assert len(plugin.task_references) == 2
+    assert sorted(len(pvs) for pvs in plugin.groups.values()) == [1, 3]
+    subscription = plugin.subscribe_channel("sine(-5, 5, 10, 0.1)")
+    first = await subscription.__anext__()
+    second = await subscription.__anext__()
+    assert first.get_value().value == 0
+    assert second.get_value().value == pytest.approx(5 * 0.5878, abs=1e-4)
+    await subscription.aclose()
+    for task in list(plugin.task_references):
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_sims_destroyed_without_listeners(monkeypatch):
+    monkeypatch.setattr(coniql.simplugin, "SIM_DESTROY_TIMEOUT", 0.3)
+    plugin = SimPlugin()
+    subscription = plugin.subscribe_channel("sine(-5, 5, 10, 0.1)")
+    await subscription.__anext__()
+    await plugin.get_channel("sine(-1, 1, 10, 0.1)", 0)
+    await asyncio.sleep(0.5)
+    # Only the sim with a listener is kept
+    assert list(plugin.sims) == ["sine(-5, 5, 10, 0.1)"]
+    await subscription.aclose()
+    await asyncio.sleep(0.5)
+    assert plugin.sims == {} and plugin.groups == {}
+    assert not plugin.task_references
+
+
+@pytest.mark.asyncio
+async def test_sims_rescheduled_after_cancel():
+    plugin = SimPlugin()
+    await plugin.get_channel("sine(-5, 5, 10, 0.1)", 0)
+    for task in list(plugin.task_references):
+        task.cancel()
+    await asyncio.sleep(0.01)
+    # The sims that can no longer tick are gone, so are made again
+    assert plugin.sims == {} and plugin.groups == {}
+    subscription = plugin.subscribe_channel("sine(-1, 1, 10, 0.1)")
+    await subscription.__anext__()
+    second = await asyncio.wait_for(subscription.__anext__(), 1)
+    assert second.get_value().value == pytest.approx(0.5878, abs=1e-4)
+    await subscription.aclose()
+    for task in list(plugin.task_references):
+        task.cancel()
+
+
+@pytest.mark.parametrize(
+    "cls, args",
+    [
+        (SineSim, [(-5, 5, 10), (-1, 1, 7, 1, 10, 20), (0, 100, 3)]),
+        (RampWaveSim, [(3, 1, 0, 2), (5,), (2, 1, 0, 10, 3)]),
+    ],
+)
+def test_compute_batch_matches_compute_changes(cls, args):
+    singles = [cls(*a) for a in args]
+    batched = [cls(*a) for a in args]
+    for _ in range(12):
+        expected = [sim.compute_changes() for sim in singles]
+        changes = cls.compute_batch(batched)
+        for old, new in zip(expected, changes):
+            assert (old.get_value() is None) == (new.get_value() is None)
+            assert old.get_status() == new.get_status()
+        for single, batch in zip(singles, batched):
+            assert np.array_equal(single.channel.value.value, batch.channel.value.value)
+            assert single.channel.status == batch.channel.status
+
+
+@pytest.mark.asyncio
+async def test_listener_merges_updates_when_full():
+    listener = SimListener("sine", maxsize=2)
+    DROPPED_UPDATES.set({"type": "sim", "pv": "sine"}, 0)
+    listener.put(SimChannel(value=ChannelValue(0)))
+    listener.put(SimChannel(value=ChannelValue(1)))
+    listener.put(SimChannel(status=ChannelStatus.alarm("Too high")))
+    listener.put(SimChannel(value=ChannelValue(3)))
+    assert listener.dropped == 2
+    assert DROPPED_UPDATES.get({"type": "sim", "pv": "sine"}) == 2
+    assert (await listener.get()).get_value() == ChannelValue(0)
+    merged = await listener.get()
+    # Only the intermediate value is lost
+    assert merged.get_value() == ChannelValue(3)
+    assert merged.get_status() == ChannelStatus.alarm("Too high")
+    assert listener.empty()
+
+
+def test_noise_dtype_and_size():
+    sim = NoiseSim(100, 1, "uint16", 10, 20)
+    value = sim.compute_changes().get_value().value
+    assert value.dtype == np.uint16 and value.shape == (100,)
+    assert value.min() >= 10 and value.max() < 20
+
+
+def test_noise_integer_dtype_defaults():
+    sim = NoiseSim(10, 0.1, "uint16")
+    value = sim.compute_changes().get_value().value
+    assert value.dtype == np.uint16 and value.max() < 5
+
+
+@pytest.mark.asyncio
+async def test_failing_sim_ends_subscription(monkeypatch: pytest.MonkeyPatch):
+    def fail(self):
+        raise ValueError("Broken")
+
+    monkeypatch.setattr(NoiseSim, "compute_changes", fail)
+    plugin = SimPlugin()
+    subscription = plugin.subscribe_channel("noise(10, 0.01)")
+    await subscription.__anext__()
+    with pytest.raises(RuntimeError, match="Sim 'noise\\(10, 0.01\\)' failed: Broken"):
+        await asyncio.wait_for(subscription.__anext__(), timeout=1)
+    assert "noise(10, 0.01)" not in plugin.sims
+    for task in list(plugin.task_references):
+        task.cancel()
+
+
+def test_counter_waveform():
+    sim = CounterSim(0.001, 3, 2, 10)
+    assert sim.channel.value.value.tolist() == [0, 2, 4]
+    assert sim.compute_changes().get_value().value.tolist() == [6, 8, 0]
+
+
+@pytest.mark.asyncio
+async def test_get_image():
+    plugin = SimPlugin()
+    channel = await plugin.get_channel("image(64, 48, 0.1, uint8, 200)", 0)
+    assert channel.get_value().value.shape == (48, 64)
+    subscription = plugin.subscribe_channel("image(64, 48, 0.1, uint8, 200)")
+    await subscription.__anext__()
+    image = (await subscription.__anext__()).get_value().value
+    assert image.dtype == np.uint8 and image.shape == (48, 64)
+    assert image[1, 3] == 199
+    await subscription.aclose()
+    for task in list(plugin.task_references):
+        task.cancel()